@@ -1,9 +1,14 @@
 import gradio as gr
-from generate_notes_from_doc import main, sync_vdb_wit_vault_recursive
+from generate_notes_from_doc import (
+    main,
+    sync_vdb_wit_vault_recursive,
+    start_vault_watcher,
+    stop_vault_watcher,
+)
 from edit_vector_db import get_all_used_filenames, delete_selected_file
 import ollama
 from chat import gr_chat, gr_chat_graph
-from obsidian_graph.parser import parse_vault
+from obsidian_graph.graph_index import load_vault_graph
 
 
 def process_inputs(
@@ -16,6 +21,10 @@ def process_inputs(
     tags,
     restrict_to_vault,
     MAX_COSINE_DISTANCE,
+    max_workers,
+    conversion_workers,
+    use_async,
+    chunks_per_group,
     model_name,
 ):
 
@@ -32,6 +41,10 @@ def process_inputs(
             tags,
             restrict_to_vault,
             MAX_COSINE_DISTANCE,
+            max_workers,
+            conversion_workers,
+            use_async,
+            chunks_per_group,
         )
 
         main(
@@ -45,6 +58,10 @@ def process_inputs(
             tags=tags,
             restrict_to_vault=restrict_to_vault,
             MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            max_workers=max_workers,
+            conversion_workers=conversion_workers,
+            use_async=use_async,
+            chunks_per_group=chunks_per_group,
         )
 
         return f"Processed with {provider} and model {model_name}\nTags: {tags}"
@@ -55,317 +72,386 @@ def process_inputs(
 
 
 
-with gr.Blocks() as demo:
-    gr.Markdown("# Obsidian Assist")
-
-    # Shared: Provider and Model Controls
-    provider = gr.Dropdown(
-        label="Provider", choices=["gemini", "huggingface", "ollama"], value="gemini"
-    )
-
-    model_input_mode = gr.Radio(
-        label="Select Model Input Type",
-        choices=["Dropdown", "Textbox"],
-        value="Dropdown",
-        interactive=True,
-    )
-
-    model_dropdown = gr.Dropdown(
-        label="Model Name (Dropdown)",
-        choices=[
-            "gemini-1.5-flash",
-            "gemini-1.5-flash-8b",
-            "gemini-1.5-pro",
-            "gemini-2.0-flash",
-            "gemini-2.0-flash-lite",
-        ],
-        value="gemini-2.0-flash",
-        visible=True,
-    )
-
-    model_textbox = gr.Textbox(
-        label="Model Name (Textbox)", placeholder="Enter model name", visible=False
-    )
-
-    # Toggle model dropdown/textbox visibility
-    def toggle_model_input(input_type):
-        if input_type == "Dropdown":
-            return gr.update(visible=True), gr.update(visible=False)
-        else:
-            return gr.update(visible=False), gr.update(visible=True)
-
-    model_input_mode.change(
-        fn=toggle_model_input,
-        inputs=model_input_mode,
-        outputs=[model_dropdown, model_textbox],
-    )
-
-    # Update model dropdown based on provider
-    def update_model_choices(selected_provider):
-        if selected_provider == "gemini":
-            return gr.update(
-                choices=[
-                    "gemini-1.5-flash",
-                    "gemini-1.5-flash-8b",
-                    "gemini-1.5-pro",
-                    "gemini-2.0-flash",
-                    "gemini-2.0-flash-lite",
-                ],
-                value="gemini-2.0-flash",
-            )
-        elif selected_provider == "huggingface":
-            return gr.update(
-                choices=["Qwen/Qwen2.5-72B-Instruct"], value="Qwen/Qwen2.5-72B-Instruct"
-            )
-        elif selected_provider == "ollama":
-            all_ollama_models = [i.model for i in ollama.list().models]
-            return gr.update(
-                choices=all_ollama_models,
-                value=all_ollama_models[0] if all_ollama_models else "",
-            )
-        else:
-            return gr.update(choices=[], value=None)
-
-    provider.change(fn=update_model_choices, inputs=provider, outputs=model_dropdown)
-
-    MAX_COSINE_DISTANCE = gr.Slider(
-        label="Max Cosine Distance",
-        info="0 indicates identical vectors and 2 indicates opposite vectors",
-        minimum=0,
-        maximum=2,
-        step=0.01,
-        value=0.3,
-    )
-
-    with gr.Tab("Generate Notes"):
-
-        # Inputs for filtering and retries
-        filter_on_headers = gr.Checkbox(
-            label="Filter on Headers",
-            info="If True, chunks with header simlar to those in cleaning_utils.headers_to_skip(like References, Index, Footnotes etc) will be skipped.",
-            value=True,
-        )
+def build_demo():
+    """
+    Build the UI. Kept out of module scope: spawned conversion and parsing workers re-import
+    this module, and must not build the UI or scan the DB for the file dropdown.
+    """
+    with gr.Blocks() as demo:
+        gr.Markdown("# Obsidian Assist")
 
-        restrict_to_vault = gr.Checkbox(
-            label="Restrict Links and context to Vault", value=False
+        # Shared: Provider and Model Controls
+        provider = gr.Dropdown(
+            label="Provider", choices=["gemini", "huggingface", "ollama"], value="gemini"
         )
 
-        MAX_LLM_RETRY = gr.Slider(
-            label="Max LLM Retry",
-            info="Number of retries on a paticular chunk in case of an error. Higher values might lead to more API calls.",
-            minimum=1,
-            maximum=10,
-            step=1,
-            value=3,
+        model_input_mode = gr.Radio(
+            label="Select Model Input Type",
+            choices=["Dropdown", "Textbox"],
+            value="Dropdown",
+            interactive=True,
         )
 
-        sleep_time = gr.Slider(
-            label="Sleep Time (seconds)",
-            info="Cool down time between LLM API calls.",
-            minimum=1,
-            maximum=60,
-            step=1,
-            value=5,
+        model_dropdown = gr.Dropdown(
+            label="Model Name (Dropdown)",
+            choices=[
+                "gemini-1.5-flash",
+                "gemini-1.5-flash-8b",
+                "gemini-1.5-pro",
+                "gemini-2.0-flash",
+                "gemini-2.0-flash-lite",
+            ],
+            value="gemini-2.0-flash",
+            visible=True,
         )
 
-        # File and directory inputs
-        source = gr.Textbox(
-            label="Source File Path", placeholder="Enter the local path to a file"
-        )
-        vault_name = gr.Textbox(
-            label="Vault Directory Path",
-            placeholder="Enter the local path to a directory",
+        model_textbox = gr.Textbox(
+            label="Model Name (Textbox)", placeholder="Enter model name", visible=False
         )
 
-        # Tags field
-        tags = gr.Textbox(
-            label="Tags",
-            placeholder="Enter tags separated by # (e.g., #tag1 #tag2). tags are also generated based on content in the backend.",
+        # Toggle model dropdown/textbox visibility
+        def toggle_model_input(input_type):
+            if input_type == "Dropdown":
+                return gr.update(visible=True), gr.update(visible=False)
+            else:
+                return gr.update(visible=False), gr.update(visible=True)
+
+        model_input_mode.change(
+            fn=toggle_model_input,
+            inputs=model_input_mode,
+            outputs=[model_dropdown, model_textbox],
         )
 
-        # Submit button
-        submit_button = gr.Button("Generate Notes")
-
-        # Output display
-        output = gr.Textbox(label="Status")
-
-        def process_model_name(model_input_type, model_dropdown, model_textbox):
-            return model_dropdown if model_input_type == "Dropdown" else model_textbox
-
-        submit_button.click(
-            fn=lambda *inputs: process_inputs(
-                *inputs[:-3], process_model_name(*inputs[-3:])
-            ),
-            inputs=[
-                filter_on_headers,
-                MAX_LLM_RETRY,
-                sleep_time,
-                source,
-                vault_name,
-                provider,
-                tags,
-                restrict_to_vault,
-                MAX_COSINE_DISTANCE,
-                model_input_mode,
-                model_dropdown,
-                model_textbox,
-            ],
-            outputs=output,
+        # Update model dropdown based on provider
+        def update_model_choices(selected_provider):
+            if selected_provider == "gemini":
+                return gr.update(
+                    choices=[
+                        "gemini-1.5-flash",
+                        "gemini-1.5-flash-8b",
+                        "gemini-1.5-pro",
+                        "gemini-2.0-flash",
+                        "gemini-2.0-flash-lite",
+                    ],
+                    value="gemini-2.0-flash",
+                )
+            elif selected_provider == "huggingface":
+                return gr.update(
+                    choices=["Qwen/Qwen2.5-72B-Instruct"], value="Qwen/Qwen2.5-72B-Instruct"
+                )
+            elif selected_provider == "ollama":
+                all_ollama_models = [i.model for i in ollama.list().models]
+                return gr.update(
+                    choices=all_ollama_models,
+                    value=all_ollama_models[0] if all_ollama_models else "",
+                )
+            else:
+                return gr.update(choices=[], value=None)
+
+        provider.change(fn=update_model_choices, inputs=provider, outputs=model_dropdown)
+
+        MAX_COSINE_DISTANCE = gr.Slider(
+            label="Max Cosine Distance",
+            info="0 indicates identical vectors and 2 indicates opposite vectors",
+            minimum=0,
+            maximum=2,
+            step=0.01,
+            value=0.3,
         )
 
-    with gr.Tab("Delete document chunks from DB"):
+        with gr.Tab("Generate Notes"):
 
-        ## vdb_notes_collection_name will automatically sync with the vault, hence no need to do it here
+            # Inputs for filtering and retries
+            filter_on_headers = gr.Checkbox(
+                label="Filter on Headers",
+                info="If True, chunks with header simlar to those in cleaning_utils.headers_to_skip(like References, Index, Footnotes etc) will be skipped.",
+                value=True,
+            )
 
-        available_files = gr.Dropdown(
-            label="Available Files",
-            choices=get_all_used_filenames(),
-            value="",
-            visible=True,
-        )
+            restrict_to_vault = gr.Checkbox(
+                label="Restrict Links and context to Vault", value=False
+            )
+
+            MAX_LLM_RETRY = gr.Slider(
+                label="Max LLM Retry",
+                info="Number of retries on a paticular chunk in case of an error. Higher values might lead to more API calls.",
+                minimum=1,
+                maximum=10,
+                step=1,
+                value=3,
+            )
 
-        delete_button = gr.Button("Delete File")
+            sleep_time = gr.Slider(
+                label="Sleep Time (seconds)",
+                info="Extra cool down before each LLM API call. Provider rate limits (<PROVIDER>_RPM/<PROVIDER>_TPM) are applied automatically.",
+                minimum=0,
+                maximum=60,
+                step=1,
+                value=0,
+            )
 
-        # Output display
-        output_del = gr.Textbox(label="Status")
+            max_workers = gr.Slider(
+                label="Parallel LLM Requests",
+                info="Number of LLM requests in flight at once. 1 processes chunks one at a time.",
+                minimum=1,
+                maximum=16,
+                step=1,
+                value=1,
+            )
 
-        ## delete all with that file name
+            use_async = gr.Checkbox(
+                label="Async LLM Requests",
+                info="Keep the parallel LLM requests in flight on one event loop instead of a thread each.",
+                value=False,
+            )
 
-        delete_button.click(
-            fn=delete_selected_file, inputs=available_files, outputs=output_del
-        )
+            chunks_per_group = gr.Slider(
+                label="Chunks Per Note",
+                info="Cluster a document's chunks by topic and make one LLM request per group of about this many chunks. 1 makes a request per chunk.",
+                minimum=1,
+                maximum=5,
+                step=1,
+                value=1,
+            )
 
-    with gr.Tab("Sync Notes Vault with DB"):
-        vault_path_sync = gr.Textbox(
-            label="Vault Path",
-            placeholder="Enter Vault directory path",
-        )
+            conversion_workers = gr.Slider(
+                label="Parallel Document Conversions",
+                info="Number of processes converting PDFs/PPTX to markdown ahead of note generation when a directory is given. 1 converts inline.",
+                minimum=1,
+                maximum=32,
+                step=1,
+                value=1,
+            )
+
+            # File and directory inputs
+            source = gr.Textbox(
+                label="Source File Path", placeholder="Enter the local path to a file"
+            )
+            vault_name = gr.Textbox(
+                label="Vault Directory Path",
+                placeholder="Enter the local path to a directory",
+            )
 
-        sync_btn = gr.Button("Sync Button")
+            # Tags field
+            tags = gr.Textbox(
+                label="Tags",
+                placeholder="Enter tags separated by # (e.g., #tag1 #tag2). tags are also generated based on content in the backend.",
+            )
 
-        # Output display
-        output_sync = gr.Textbox(label="Status")
+            # Submit button
+            submit_button = gr.Button("Generate Notes")
 
-        sync_btn.click(
-            fn=sync_vdb_wit_vault_recursive, inputs=vault_path_sync, outputs=output_sync
-        )
-    with gr.Tab("Chat"):
-        with gr.Tab("Simple RAG"):
-            gr.ChatInterface(
-                fn=lambda *inputs: gr_chat(
-                    message=inputs[0],
-                    history=inputs[1],
-                    provider=inputs[2],
-                    model_name=process_model_name(*inputs[-3:]),
-                    MAX_COSINE_DISTANCE=inputs[3],
+            # Output display
+            output = gr.Textbox(label="Status")
+
+            def process_model_name(model_input_type, model_dropdown, model_textbox):
+                return model_dropdown if model_input_type == "Dropdown" else model_textbox
+
+            submit_button.click(
+                fn=lambda *inputs: process_inputs(
+                    *inputs[:-3], process_model_name(*inputs[-3:])
                 ),
-                title="Notes chat",
-                description="Ask me anything!",
-                theme="soft",
-                type="messages",
-                additional_inputs=[
+                inputs=[
+                    filter_on_headers,
+                    MAX_LLM_RETRY,
+                    sleep_time,
+                    source,
+                    vault_name,
                     provider,
+                    tags,
+                    restrict_to_vault,
                     MAX_COSINE_DISTANCE,
+                    max_workers,
+                    conversion_workers,
+                    use_async,
+                    chunks_per_group,
                     model_input_mode,
                     model_dropdown,
                     model_textbox,
                 ],
-            )
-        with gr.Tab("Graph Based Context"):
-
-            def update_nodes_dropdown_with_vault_files(notes_vault_path):
-                ## update option according to vault
-                notes = parse_vault(notes_vault_path)
-                notes_keys = list(notes.keys())
-
-                dropdown_options = ["None"]
-                dropdown_options.extend(notes_keys)
-
-                print(dropdown_options)
-
-                return [
-                    notes,
-                    gr.update(
-                        choices=dropdown_options,
-                        value=dropdown_options[0],
-                        visible=True,
-                    ),
-                    gr.update(
-                        choices=dropdown_options,
-                        value=dropdown_options[0],
-                        visible=True,
-                    ),
-                ]
-
-            notes_vault_path = gr.Textbox(
-                label="Vault Path",
-                placeholder="Enter Vault directory path whose graph should be used",
+                outputs=output,
             )
 
-            notes_sync_init_btn = gr.Button("Initialize")
+        with gr.Tab("Delete document chunks from DB"):
 
-            hops = gr.Slider(
-                label="Hops",
-                info="Number of hops ancestors/children from the chosen node. Not used if End is selected",
-                minimum=1,
-                maximum=10,
-                step=1,
-                value=1,
+            ## vdb_notes_collection_name will automatically sync with the vault, hence no need to do it here
+
+            available_files = gr.Dropdown(
+                label="Available Files",
+                choices=get_all_used_filenames(),
+                value="",
+                visible=True,
             )
 
-            start_notes_dropdown = gr.Dropdown(
-                label="Start",
-                choices=["None"],
-                value="None",
-                interactive=True,
-                visible=False,
+            delete_button = gr.Button("Delete File")
+
+            # Output display
+            output_del = gr.Textbox(label="Status")
+
+            ## delete all with that file name
+
+            def delete_file_and_report(filename_to_del):
+                counts = delete_selected_file(filename_to_del)
+                if counts is None:
+                    return f"Failed to delete {filename_to_del}"
+                return f"Deleted {counts['deleted']} chunks of {filename_to_del}"
+
+            delete_button.click(
+                fn=delete_file_and_report, inputs=available_files, outputs=output_del
             )
 
-            end_notes_dropdown = gr.Dropdown(
-                label="End",
-                info="If selected, the shortest path between Start and End will be included in context.",
-                choices=["None"],
-                value="None",
-                interactive=True,
-                visible=False,
+        with gr.Tab("Sync Notes Vault with DB"):
+            vault_path_sync = gr.Textbox(
+                label="Vault Path",
+                placeholder="Enter Vault directory path",
             )
 
-            notes = gr.State({})
+            sync_btn = gr.Button("Sync Button")
 
-            notes_sync_init_btn.click(
-                fn=update_nodes_dropdown_with_vault_files,
-                inputs=notes_vault_path,
-                outputs=[notes, start_notes_dropdown, end_notes_dropdown],
-            )
+            # Output display
+            output_sync = gr.Textbox(label="Status")
 
-            graph_chat = gr.ChatInterface(
-                fn=lambda *inputs: gr_chat_graph(
-                    message=inputs[0],
-                    history=inputs[1],
-                    provider=inputs[2],
-                    model_name=process_model_name(*inputs[-3:]),
-                    MAX_COSINE_DISTANCE=inputs[3],
-                    start=inputs[4],
-                    end=inputs[5],
-                    notes=inputs[6],
-                    hops=inputs[7],
-                ),
-                title="Graph chat",
-                description="Intialize Vault and then ask me anything!",
-                theme="soft",
-                type="messages",
-                additional_inputs=[
-                    provider,
-                    MAX_COSINE_DISTANCE,
-                    start_notes_dropdown,
-                    end_notes_dropdown,
-                    notes,
-                    hops,
-                    model_input_mode,
-                    model_dropdown,
-                    model_textbox,
-                ],
+            sync_btn.click(
+                fn=sync_vdb_wit_vault_recursive, inputs=vault_path_sync, outputs=output_sync
             )
 
+            with gr.Row():
+                watch_btn = gr.Button("Watch Vault")
+                stop_watch_btn = gr.Button("Stop Watching")
 
-demo.launch()
+            watch_btn.click(
+                fn=start_vault_watcher, inputs=vault_path_sync, outputs=output_sync
+            )
+            stop_watch_btn.click(
+                fn=stop_vault_watcher, inputs=vault_path_sync, outputs=output_sync
+            )
+        with gr.Tab("Chat"):
+            with gr.Tab("Simple RAG"):
+                ## generator functions so ChatInterface streams the answer
+                def simple_chat_fn(*inputs):
+                    yield from gr_chat(
+                        message=inputs[0],
+                        history=inputs[1],
+                        provider=inputs[2],
+                        model_name=process_model_name(*inputs[-3:]),
+                        MAX_COSINE_DISTANCE=inputs[3],
+                    )
+
+                gr.ChatInterface(
+                    fn=simple_chat_fn,
+                    title="Notes chat",
+                    description="Ask me anything!",
+                    theme="soft",
+                    type="messages",
+                    additional_inputs=[
+                        provider,
+                        MAX_COSINE_DISTANCE,
+                        model_input_mode,
+                        model_dropdown,
+                        model_textbox,
+                    ],
+                )
+            with gr.Tab("Graph Based Context"):
+
+                def update_nodes_dropdown_with_vault_files(notes_vault_path):
+                    ## update option according to vault, only notes changed since the last load are parsed
+                    vault_graph = load_vault_graph(notes_vault_path)
+                    notes_keys = list(vault_graph.notes.keys())
+
+                    dropdown_options = ["None"]
+                    dropdown_options.extend(notes_keys)
+
+                    print(dropdown_options)
+
+                    return [
+                        vault_graph,
+                        gr.update(
+                            choices=dropdown_options,
+                            value=dropdown_options[0],
+                            visible=True,
+                        ),
+                        gr.update(
+                            choices=dropdown_options,
+                            value=dropdown_options[0],
+                            visible=True,
+                        ),
+                    ]
+
+                notes_vault_path = gr.Textbox(
+                    label="Vault Path",
+                    placeholder="Enter Vault directory path whose graph should be used",
+                )
+
+                notes_sync_init_btn = gr.Button("Initialize")
+
+                hops = gr.Slider(
+                    label="Hops",
+                    info="Number of hops ancestors/children from the chosen node. Not used if End is selected",
+                    minimum=1,
+                    maximum=10,
+                    step=1,
+                    value=1,
+                )
+
+                start_notes_dropdown = gr.Dropdown(
+                    label="Start",
+                    choices=["None"],
+                    value="None",
+                    interactive=True,
+                    visible=False,
+                )
+
+                end_notes_dropdown = gr.Dropdown(
+                    label="End",
+                    info="If selected, the shortest path between Start and End will be included in context.",
+                    choices=["None"],
+                    value="None",
+                    interactive=True,
+                    visible=False,
+                )
+
+                notes = gr.State({})
+
+                notes_sync_init_btn.click(
+                    fn=update_nodes_dropdown_with_vault_files,
+                    inputs=notes_vault_path,
+                    outputs=[notes, start_notes_dropdown, end_notes_dropdown],
+                )
+
+                def graph_chat_fn(*inputs):
+                    yield from gr_chat_graph(
+                        message=inputs[0],
+                        history=inputs[1],
+                        provider=inputs[2],
+                        model_name=process_model_name(*inputs[-3:]),
+                        MAX_COSINE_DISTANCE=inputs[3],
+                        start=inputs[4],
+                        end=inputs[5],
+                        notes=inputs[6],
+                        hops=inputs[7],
+                    )
+
+                graph_chat = gr.ChatInterface(
+                    fn=graph_chat_fn,
+                    title="Graph chat",
+                    description="Intialize Vault and then ask me anything!",
+                    theme="soft",
+                    type="messages",
+                    additional_inputs=[
+                        provider,
+                        MAX_COSINE_DISTANCE,
+                        start_notes_dropdown,
+                        end_notes_dropdown,
+                        notes,
+                        hops,
+                        model_input_mode,
+                        model_dropdown,
+                        model_textbox,
+                    ],
+                )
+
+    return demo
+
+
+if __name__ == "__main__":
+    build_demo().launch()
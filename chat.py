@@ -1,4 +1,4 @@
-from utils.chromaDB_Handler import ChromaDBHandler
+from utils.chromaDB_Handler import get_chroma_handler
 import os
 
 
@@ -6,11 +6,12 @@ from utils.basic_utils import merge_dicts
 
 
 from utils.LLMHandler import LLMHandler
+from utils.prompt_builder import PromptBuilder
 
 from obsidian_graph.graph_builder import build_undirected_graph
-from obsidian_graph.utils import bfs_upto_levels
+from obsidian_graph.graph_index import VaultGraph
+from obsidian_graph.utils import bfs_upto_levels, shortest_path
 
-import networkx as nx
 
 import logging
 
@@ -22,8 +23,10 @@ CHROMA_DB_PATH = os.environ["CHROMA_DB_PATH"]
 vdb_collection_name = os.environ["markdown_chunk_collection_vdb"]  ## this is where we save the MD chunks from the PDF
 vdb_notes_collection_name = os.environ["markdown_notes_collection_vdb"]  ## this is where we save the LLM generated summary, title, vault_name
 
-# Initialize the database handler with the custom embedding function
-vdb_handler = ChromaDBHandler(path=CHROMA_DB_PATH)
+# Shared database handler, its client and embedding model are loaded on first use
+vdb_handler = get_chroma_handler(CHROMA_DB_PATH)
+
+CHAT_SYSTEM_PROMPT = "Answer the user query in markdown. You are a professional assistant."
 
 
 def get_RAG_context(user_prompt, MAX_COSINE_DISTANCE=0.3,n_results=3):
@@ -46,7 +49,37 @@ def get_RAG_context(user_prompt, MAX_COSINE_DISTANCE=0.3,n_results=3):
     return context, context_metadata.get("title")
 
 
+def get_RAG_contexts(user_prompts, MAX_COSINE_DISTANCE=0.3, n_results=(3,)):
+    """
+    Same as get_RAG_context for several prompts at once, embedded and searched in one batched query.
+    n_results gives the number of results per prompt.
+    """
+    print(f'Getting Context for:{user_prompts} ')
+    query_fields = ["documents", "distances", "metadatas"]
+
+    per_query_results = vdb_handler.query_collection_batched(
+        vdb_notes_collection_name,
+        query_texts=list(user_prompts),
+        n_results=max(n_results),
+        include=query_fields,
+        max_distance=MAX_COSINE_DISTANCE,
+    )
+
+    contexts = []
+    for results, n in zip(per_query_results, n_results):
+        ## results are sorted by distance, so the first n equal a query for n results
+        documents = results["documents"][0][:n]
+        metadatas = results["metadatas"][0][:n]
+
+        context = "\n".join(documents)
+        context_metadata = merge_dicts(metadatas)
+        contexts.append((context, context_metadata.get("title")))
+
+    return contexts
+
+
 def gr_chat(message, history, MAX_COSINE_DISTANCE,provider, model_name):
+    """Generator yielding the growing answer, for streaming in gr.ChatInterface"""
     # Combine the history into a single string for context
     history_text = ""
     for turn in history:
@@ -54,18 +87,13 @@ def gr_chat(message, history, MAX_COSINE_DISTANCE,provider, model_name):
         content = turn.get("content", "")
         history_text += f"{role.capitalize()}: {content}\n"
 
-    # Retrieve context related to the current question
-    context, reference = get_RAG_context(message, 
-                                         MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
-                                         n_results=3
-                                         )
-
-    # Get historical context
+    # Retrieve context related to the current question and the historical context in one batch
     query = f"{history_text}User: {message}"
-    context_with_history, reference_with_history = get_RAG_context(query, 
-                                                                   MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
-                                                                   n_results=2
-                                                                   )
+    (context, reference), (context_with_history, reference_with_history) = get_RAG_contexts(
+        [message, query],
+        MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+        n_results=(3, 2),
+    )
     if reference is not None and reference_with_history is not None:
         reference.extend(reference_with_history)
     else:
@@ -74,28 +102,33 @@ def gr_chat(message, history, MAX_COSINE_DISTANCE,provider, model_name):
     print(reference)
 
     if reference==None:
-        return "Couldn't find reference to answer your query. Maybe loosen the similarity threshold?"
-
-    if context is not None and context_with_history is not None:
-        context += '\n' + context_with_history
-    elif context is not None or context_with_history is not None:
-        context = context or context_with_history
-
-    # Construct the user prompt with history and context
-    user_prompt = f"{history_text}User: {message}\n\nCONTEXT:\n{context}"
+        yield "Couldn't find reference to answer your query. Maybe loosen the similarity threshold?"
+        return
+
+    # Construct the user prompt with history and context, within the prompt token budget
+    user_prompt, _, _ = PromptBuilder(provider, model_name).build_chat_prompt(
+        message,
+        history,
+        [c for c in (context, context_with_history) if c],
+        system_prompt=CHAT_SYSTEM_PROMPT,
+    )
 
-    llm = LLMHandler(provider=provider,model_name=model_name)
+    ## a chat reply should be generated fresh, e.g. when the user retries the same message
+    llm = LLMHandler(provider=provider, model_name=model_name, use_cache=False)
 
-    # Generate response using your LLM
-    response = llm.generate(
-        system_prompt="Answer the user query in markdown. You are a professional assistant.",
+    # Stream the response so the chat renders tokens as they arrive
+    response = ""
+    for piece in llm.generate_stream(
+        system_prompt=CHAT_SYSTEM_PROMPT,
         user_prompt=user_prompt,
-    )
+    ):
+        response += piece
+        yield response
 
     reference_formatted = "\n- ".join(reference)
     response += f"\n\n## Reference\n- {reference_formatted}"
 
-    return response
+    yield response
 
 
 def gr_chat_graph(
@@ -110,15 +143,12 @@ def gr_chat_graph(
     model_name
 ):
 
-    graph = build_undirected_graph(notes)
-    print(graph.nodes)
-
-    # Combine the history into a single string for context
-    history_text = ""
-    for turn in history:
-        role = turn.get("role", "")
-        content = turn.get("content", "")
-        history_text += f"{role.capitalize()}: {content}\n"
+    ## notes is the VaultGraph from Initialize, its graph is built once and reused for every message
+    if isinstance(notes, VaultGraph):
+        graph, notes = notes.graph, notes.notes
+    else:
+        graph = build_undirected_graph(notes)
+    logging.info(f"Graph with {graph.number_of_nodes()} notes and {graph.number_of_edges()} links")
 
     references = []
     ## make sure to remove the base64 image from content
@@ -130,7 +160,8 @@ def gr_chat_graph(
         )
 
         if reference == None:
-            return "Couldn't find reference to answer your query. Maybe loosen the similarity threshold or try selecting different start and ends?"
+            yield "Couldn't find reference to answer your query. Maybe loosen the similarity threshold or try selecting different start and ends?"
+            return
 
         if isinstance(reference, list):
             reference = reference[0]
@@ -152,10 +183,11 @@ def gr_chat_graph(
     elif start != "None" and end != "None":
         try:
             ## use the shortest path b/w them to build context
-            references = nx.shortest_path(graph, source=start, target=end)
+            references = shortest_path(graph, source=start, target=end)
         except Exception as e:
             logging.info(e)
-            return f"No path between {start} and {end}."
+            yield f"No path between {start} and {end}."
+            return
 
     max_reference = 10
     if not references:
@@ -164,24 +196,30 @@ def gr_chat_graph(
     print(references)
 
     if references == None:
-        return "Couldn't find reference to answer your query. Maybe loosen the similarity threshold or try selecting different start and ends?"
-
-    context = ""
-    for r in references:
-        context += notes[r]["content"]
-
-    # Construct the user prompt with history and context
-    user_prompt = f"{history_text}User: {message}\n\nCONTEXT:\n{context}"
+        yield "Couldn't find reference to answer your query. Maybe loosen the similarity threshold or try selecting different start and ends?"
+        return
+
+    # Construct the user prompt with history and context, notes are added in BFS/path order until the budget is used
+    user_prompt, _, n_used = PromptBuilder(provider, model_name).build_chat_prompt(
+        message,
+        history,
+        [notes[r]["content"] for r in references],
+        system_prompt=CHAT_SYSTEM_PROMPT,
+    )
+    references = references[:n_used]
 
-    llm = LLMHandler(provider=provider, model_name=model_name)
+    llm = LLMHandler(provider=provider, model_name=model_name, use_cache=False)
 
-    # Generate response using your LLM
-    response = llm.generate(
-        system_prompt="Answer the user query in markdown. You are a professional assistant.",
+    # Stream the response so the chat renders tokens as they arrive
+    response = ""
+    for piece in llm.generate_stream(
+        system_prompt=CHAT_SYSTEM_PROMPT,
         user_prompt=user_prompt,
-    )
+    ):
+        response += piece
+        yield response
 
     reference_formatted = "\n- ".join(references)
     response += f"\n\n## Reference\n- {reference_formatted}"
 
-    return response
+    yield response
@@ -1,6 +1,8 @@
 import os
+from collections import Counter
 
-from utils.chromaDB_Handler import ChromaDBHandler
+from utils.chromaDB_Handler import get_chroma_handler
+from utils.filename_index import get_filename_index
 
 CHROMA_DB_PATH = os.environ["CHROMA_DB_PATH"]
 vdb_collection_name = os.environ[
@@ -10,8 +12,8 @@ vdb_notes_collection_name = os.environ[
     "markdown_notes_collection_vdb"
 ]  ## this is where we save the LLM generated summary, title, vault_name
 
-# Initialize the database handler with the custom embedding function
-vdb_handler = ChromaDBHandler(path=CHROMA_DB_PATH)
+# Shared database handler, its client and embedding model are loaded on first use
+vdb_handler = get_chroma_handler(CHROMA_DB_PATH)
 
 import logging
 
@@ -19,21 +21,38 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 
+def rebuild_filename_index():
+    """
+    Rebuild the filename side index from a paginated scan of the chunk metadata.
+    Only needed once, afterwards the index is updated as chunks are added and deleted.
+    """
+    filename_counts = Counter()
+    for results in vdb_handler.iter_collection(
+        vdb_collection_name, include=["metadatas"], metadata_keys=["filename"]
+    ):
+        filename_counts.update(
+            metadata["filename"] for metadata in results["metadatas"] if metadata and metadata.get("filename")
+        )
+
+    get_filename_index().rebuild(vdb_collection_name, filename_counts)
+    logging.info(f"Indexed {len(filename_counts)} files of {vdb_collection_name}.")
+
+
 def get_all_used_filenames():
     """
     This function returns a list of all the files whose chunks are stored 
     in the vdb_collection_name VDB
     """
-    results = vdb_handler.get_in_collection(vdb_collection_name, include=["metadatas"])
-    all_files = {metadata["filename"] for metadata in results["metadatas"]}
-    return list(all_files)
+    filename_index = get_filename_index()
+    if not filename_index.is_built(vdb_collection_name):
+        rebuild_filename_index()
+    return filename_index.filenames(vdb_collection_name)
 
 
-def delete_selected_file(filename_to_del):
+def delete_selected_file(filename_to_del, dry_run=False):
     try:
-        results = vdb_handler.get_in_collection(
+        counts = vdb_handler.delete_where(
             vdb_collection_name,
-            include=["metadatas"],
             where={
                 "filename": {"$eq": filename_to_del}
                 # "$and": [
@@ -41,19 +60,16 @@ def delete_selected_file(filename_to_del):
                 #     {"filename": {"$eq": filename_to_del}},
                 # ]
             },
+            dry_run=dry_run,
         )
 
-        logging.info(f'Deleting {len(results["metadatas"])} chunks for {filename_to_del}.')
-
-        ids_to_del = results["ids"]
+        if dry_run:
+            logging.info(f'{counts["matched"]} chunks would be deleted for {filename_to_del}.')
+            return counts
 
-        logging.info(f"ids to delete: {ids_to_del}")
-
-        vdb_handler.delete_from_collection(
-            collection_name=vdb_collection_name,
-            ids=ids_to_del
-        )
+        get_filename_index().remove(vdb_collection_name, [filename_to_del])
 
-        logging.info(f"DELETED!")
+        logging.info(f'DELETED {counts["deleted"]} chunks for {filename_to_del}!')
+        return counts
     except Exception as e:
         logging.warning(f'Failed to delete {filename_to_del}')
@@ -1,7 +1,13 @@
 import os
 
-from utils.chromaDB_Handler import ChromaDBHandler
-from utils.LLMHandler import LLMHandler
+from utils.chromaDB_Handler import get_chroma_handler
+from utils.LLMHandler import LLMHandler, run_async
+from utils.prompt_builder import PromptBuilder
+from utils.chunk_dedup import ChunkDeduplicator
+from utils.chunk_planner import plan_chunk_groups, estimate_plan_cost
+from utils.image_blob_store import resolve_image_reference
+from utils.vault_manifest import get_vault_manifest, scan_vault
+from utils.vault_watcher import VaultWatcher
 from utils.basic_utils import (
     generate_unique_id,
     extract_and_parse_json,
@@ -13,8 +19,13 @@ from utils.basic_utils import (
 )
 from prompts import system_prompt
 
+import asyncio
 import time
 import re
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 CHROMA_DB_PATH = os.environ["CHROMA_DB_PATH"]
 vdb_collection_name = os.environ[
@@ -24,174 +35,301 @@ vdb_notes_collection_name = os.environ[
     "markdown_notes_collection_vdb"
 ]  ## this is where we save the LLM generated summary, title, vault_name
 
-# Initialize the database handler with the custom embedding function
-vdb_handler = ChromaDBHandler(path=CHROMA_DB_PATH)
+# Shared database handler, its client and embedding model are loaded on first use
+vdb_handler = get_chroma_handler(CHROMA_DB_PATH)
 
 from store_in_vectore_db import store_doc_to_vector_db, dissect_markdown_with_images
+from utils.doc_converter import convert_all, convert_batch, init_conversion_worker
 
+## serializes vault syncs (manual, watcher and at the start of main) with note writes
+_sync_lock = threading.RLock()
+_vault_watchers = dict()  ## normalized vault path -> VaultWatcher
 
-def sync_vdb_wit_vault_recursive(vault_name):
+
+def _read_note_for_db(source):
+    """read a vault note, returns (raw content, content to store in the notes DB)"""
+    with open(source, "r", encoding="utf-8") as file:
+        raw_content = file.read()
+
+    md_content = raw_content
+    if "![Image]" in md_content:
+        ## notes DB records don't keep image references, so the images are only stripped
+        updated_text, image_dict = dissect_markdown_with_images(md_content, persist=False)
+        md_content = updated_text
+
+    return raw_content, md_content
+
+
+def _lookup_note_records(vault_dir_to_titles, batch_size=500):
     """
-    Add and delete from VDB to match its records with the vault and sub vaults to avoid
-    creating dead link and to not miss out on any potential links
+    find existing notes DB records for (vault_path, title) pairs without scanning the whole collection.
+    Returns (vault_path, title) -> (id, stored document)
     """
+    found = dict()
+    for vault_dir, titles in vault_dir_to_titles.items():
+        titles = list(titles)
+        for start in range(0, len(titles), batch_size):
+            results = vdb_handler.get_in_collection(
+                vdb_notes_collection_name,
+                include=["metadatas", "documents"],
+                where={
+                    "$and": [
+                        {"vault_path": {"$eq": vault_dir}},
+                        {"title": {"$in": titles[start:start + batch_size]}},
+                    ]
+                },
+            )
+            for id, meta, document in zip(results["ids"], results["metadatas"], results["documents"]):
+                found.setdefault((vault_dir, meta["title"]), (id, document))
+    return found
 
-    try:
-        print(
-            f"Syncing Notes DB with Deletions and Additions in the Vault and Sub Vaults."
-        )
-        all_md_files_in_vault, all_md_files_to_vault_path = [], dict()
-        all_vaults = set()
-        ## walk through the vault dir and find all the .md files
-        for root, _, files in os.walk(vault_name):
-            all_vaults.add(root)
-            for fname in files:
-                if fname.lower().endswith(".md"):
-                    # full_path = os.path.join(root, fname)
-                    all_md_files_in_vault.append(fname)
-                    all_md_files_to_vault_path[fname] = root  ## used during addition
-        all_vaults = list(all_vaults)
-        all_md_files_in_vault_without_suffix = [i[:-3] for i in all_md_files_in_vault]
-
-        ## get all records
-        results = vdb_handler.get_in_collection(
+
+def _delete_untracked_records(vault_dirs, on_disk_titles):
+    """
+    delete notes DB records whose note is not in the vault anymore. Only needed when the
+    manifest doesn't know the vault yet (first sync) or a full reconciliation is requested.
+    Records are paged per vault directory and deleted batch by batch, so no list of every
+    title or record id is sent to the DB.
+    """
+    n_deleted = 0
+    for vault_dir in vault_dirs:
+        counts = vdb_handler.delete_where(
             vdb_notes_collection_name,
-            include=["metadatas"],
-            where={"vault_path": {"$in": all_vaults}},
+            where={"vault_path": {"$eq": vault_dir}},
+            keep=lambda meta, vault_dir=vault_dir: (vault_dir, meta.get("title")) in on_disk_titles,
+            metadata_keys=["title"],
         )
+        n_deleted += counts["deleted"]
 
-        print(f"Number of files in the vault: {len(all_md_files_in_vault)}")
-        print(f'Number of records in Notes DB: {len(results["ids"])}')
-
-        ids_to_del = []
-        all_valid_titles = []
+    if n_deleted:
+        print(f"DELETED {n_deleted} records of notes that are not in the vault.")
 
-        # ==========deletion===========
-        for id, meta in zip(results["ids"], results["metadatas"]):
-            title = meta["title"]
-            # print(id, title)
+    return n_deleted
 
-            ## deleting a record from ChromaDB because that note was deleted in Obsidan vault by the user
-            if title not in all_md_files_in_vault_without_suffix:
-                print(f"DELETING: {title}")
-                ids_to_del.append(id)
-            else:
-                all_valid_titles.append(title)
 
-        if ids_to_del:
-            vdb_handler.delete_from_collection(
-                collection_name=vdb_notes_collection_name, ids=ids_to_del
-            )
+def record_note_in_manifest(note_path, note_id, content):
+    """record a note written by the app so the next sync doesn't treat it as new"""
+    manifest = get_vault_manifest()
+    previous = manifest.get(note_path)
+    if previous is not None and previous["id"] != note_id:
+        ## the note overwrote an existing file, drop that file's record so it isn't orphaned
+        vdb_handler.delete_from_collection(
+            collection_name=vdb_notes_collection_name, ids=[previous["id"]]
+        )
 
-        # ===============Addition=================
-        for exisitng_vault_file in all_md_files_in_vault:
-            ## adding a record in ChromaDB because that note was created in Obsidan vault by the user
-            exisitng_vault_file_no_suffix = exisitng_vault_file[:-3]
-            if exisitng_vault_file_no_suffix not in all_valid_titles:
-                print(f"ADDING: {exisitng_vault_file}")
-                print("=========Reading Markdown file from source=======")
-                # Open the Markdown file in read mode(NEEDS correct vault path: TODO)
-                source = os.path.join(
-                    all_md_files_to_vault_path[exisitng_vault_file], exisitng_vault_file
-                )
-                with open(source, "r", encoding="utf-8") as file:
-                    md_content = file.read()
-                if "![Image]" in md_content:
-                    updated_text, image_dict = dissect_markdown_with_images(md_content)
-                    md_content = updated_text
-
-                # add to notes vector DB
-                vdb_handler.add_to_collection(
-                    vdb_notes_collection_name,
-                    ids=[generate_unique_id()],
-                    documents=[md_content],
-                    metadatas=[
-                        {
-                            "title": exisitng_vault_file_no_suffix,
-                            "vault_path": all_md_files_to_vault_path[
-                                exisitng_vault_file
-                            ],
-                            "vault_dir": os.path.basename(
-                                all_md_files_to_vault_path[exisitng_vault_file]
-                            ),
-                        }
-                    ],
-                )
-    except Exception as e:
-        print(f"Failed to sync DB with Vault.\nError: {e}")
+    stat = os.stat(note_path)
+    manifest.upsert(
+        {
+            note_path: {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "hash": generate_unique_hash(content),
+                "id": note_id,
+            }
+        }
+    )
 
 
-def sync_vdb_wit_vault(vault_name):
+def sync_vault_incremental(vault_name, recursive=True, full=False, batch_size=256):
     """
-    Add and delete from VDB to match its records with the vault to avoid
-    creating dead link and to not miss out on any potential links
+    Sync the notes DB with the vault using the vault manifest (path -> mtime, size, content hash, id).
+    Only new, modified and deleted notes are touched, modified notes are upserted.
+    A full reconciliation against the DB runs on the first sync of a vault or when full is set.
     """
+    with _sync_lock:
+        return _sync_vault_incremental(vault_name, recursive=recursive, full=full, batch_size=batch_size)
+
+
+def _sync_vault_incremental(vault_name, recursive=True, full=False, batch_size=256):
+
+    manifest = get_vault_manifest()
+    on_disk = scan_vault(vault_name, recursive=recursive)
+    known = manifest.entries(vault_name, recursive=recursive)
+
+    print(f"Number of files in the vault: {len(on_disk)}")
+    print(f"Number of notes in the manifest: {len(known)}")
+
+    deleted_paths = [path for path in known if path not in on_disk]
+    new_paths = [path for path in on_disk if path not in known]
+    changed_paths = [
+        path
+        for path, (_, stat) in on_disk.items()
+        if path in known
+        and (stat.st_mtime != known[path]["mtime"] or stat.st_size != known[path]["size"])
+    ]
+
+    n_deleted = 0
+    # ==========deletion===========
+    if deleted_paths:
+        ids_to_del = [known[path]["id"] for path in deleted_paths]
+        for path in deleted_paths:
+            print(f"DELETING: {os.path.basename(path)[:-3]}")
+        vdb_handler.delete_from_collection(
+            collection_name=vdb_notes_collection_name, ids=ids_to_del
+        )
+        manifest.remove(deleted_paths)
+        n_deleted += len(ids_to_del)
+
+    if full or not known:
+        ## every walked directory, including emptied subfolders whose records must still be deleted
+        if recursive:
+            vault_dirs = {root for root, _, _ in os.walk(vault_name)}
+        else:
+            vault_dirs = {vault_name}
+        on_disk_titles = {
+            (vault_dir, os.path.basename(path)[:-3]) for path, (vault_dir, _) in on_disk.items()
+        }
+        n_deleted += _delete_untracked_records(vault_dirs, on_disk_titles)
+
+    # ===============Addition=================
+    vault_dir_to_titles = dict()
+    for path in new_paths:
+        vault_dir = on_disk[path][0]
+        vault_dir_to_titles.setdefault(vault_dir, set()).add(os.path.basename(path)[:-3])
+    existing_records = _lookup_note_records(vault_dir_to_titles) if new_paths else dict()
+
+    manifest_updates = dict()
+    to_add = []
+    to_update = []
+    for path in new_paths:
+        vault_dir, stat = on_disk[path]
+        title = os.path.basename(path)[:-3]
+        raw_content, md_content = _read_note_for_db(path)
+        note_id, stored_document = existing_records.get((vault_dir, title), (None, None))
+
+        if note_id is not None and stored_document != md_content:
+            ## adopting a record written before the manifest existed, the note changed since
+            print(f"UPDATING: {title}")
+            to_update.append((note_id, md_content))
+        elif note_id is None:
+            ## adding a record in ChromaDB because that note was created in Obsidan vault by the user
+            print(f"ADDING: {title}")
+            note_id = generate_unique_id()
+            to_add.append(
+                (
+                    note_id,
+                    md_content,
+                    {
+                        "title": title,
+                        "vault_path": vault_dir,
+                        "vault_dir": os.path.basename(vault_dir),
+                    },
+                )
+            )
 
-    try:
-        print(f"Syncing Notes DB with Deletions and Additions in the Vault.")
-        all_md_files_in_vault = [i for i in os.listdir(vault_name) if i[-3:] == ".md"]
-        all_md_files_in_vault_without_suffix = [i[:-3] for i in all_md_files_in_vault]
+        manifest_updates[path] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": generate_unique_hash(raw_content),
+            "id": note_id,
+        }
 
-        ## get all records
-        results = vdb_handler.get_in_collection(
+    for start in range(0, len(to_add), batch_size):
+        batch = to_add[start:start + batch_size]
+        vdb_handler.add_to_collection(
             vdb_notes_collection_name,
-            include=["metadatas"],
-            where={"vault_path": {"$eq": vault_name}},
+            ids=[i[0] for i in batch],
+            documents=[i[1] for i in batch],
+            metadatas=[i[2] for i in batch],
         )
 
-        print(f"Number of files in the vault: {len(all_md_files_in_vault)}")
-        print(f'Number of records in Notes DB: {len(results["ids"])}')
+    # ===============Modification=================
+    for path in changed_paths:
+        vault_dir, stat = on_disk[path]
+        raw_content, md_content = _read_note_for_db(path)
+        content_hash = generate_unique_hash(raw_content)
+
+        if content_hash != known[path]["hash"]:
+            ## upserting because the user edited the note in the Obsidian vault
+            print(f"UPDATING: {os.path.basename(path)[:-3]}")
+            to_update.append((known[path]["id"], md_content))
+
+        manifest_updates[path] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": content_hash,
+            "id": known[path]["id"],
+        }
+
+    for start in range(0, len(to_update), batch_size):
+        batch = to_update[start:start + batch_size]
+        vdb_handler.update_in_collection(
+            vdb_notes_collection_name,
+            ids=[i[0] for i in batch],
+            documents=[i[1] for i in batch],
+        )
 
-        ids_to_del = []
-        all_valid_titles = []
+    if manifest_updates:
+        manifest.upsert(manifest_updates)
 
-        # ==========deletion===========
-        for id, meta in zip(results["ids"], results["metadatas"]):
-            title = meta["title"]
-            # print(id, title)
+    summary = f"Synced {vault_name}: added {len(to_add)}, updated {len(to_update)}, deleted {n_deleted}."
+    print(summary)
+    return summary
 
-            ## deleting a record from ChromaDB because that note was deleted in Obsidan vault by the user
-            if title not in all_md_files_in_vault_without_suffix:
-                print(f"DELETING: {title}")
-                ids_to_del.append(id)
-            else:
-                all_valid_titles.append(title)
 
-        if ids_to_del:
-            vdb_handler.delete_from_collection(
-                collection_name=vdb_notes_collection_name, ids=ids_to_del
-            )
+def start_vault_watcher(vault_name, interval=2.0, debounce=1.0):
+    """start a background watcher that keeps the notes DB synced with the vault and sub vaults"""
+    if not vault_name or not os.path.isdir(vault_name):
+        return f"Not a directory: {vault_name}"
 
-        # ===============Addition=================
-        for exisitng_vault_file in all_md_files_in_vault:
-            ## adding a record in ChromaDB because that note was created in Obsidan vault by the user
-            exisitng_vault_file_no_suffix = exisitng_vault_file[:-3]
-            if exisitng_vault_file_no_suffix not in all_valid_titles:
-                print(f"ADDING: {exisitng_vault_file}")
-                print("=========Reading Markdown file from source=======")
-                # Open the Markdown file in read mode
-                source = os.path.join(vault_name, exisitng_vault_file)
-                with open(source, "r", encoding="utf-8") as file:
-                    md_content = file.read()
-                if "![Image]" in md_content:
-                    updated_text, image_dict = dissect_markdown_with_images(md_content)
-                    md_content = updated_text
-
-                # add to notes vector DB
-                vdb_handler.add_to_collection(
-                    vdb_notes_collection_name,
-                    ids=[generate_unique_id()],
-                    documents=[md_content],
-                    metadatas=[
-                        {
-                            "title": exisitng_vault_file_no_suffix,
-                            "vault_path": vault_name,
-                            "vault_dir": os.path.basename(vault_name),
-                        }
-                    ],
-                )
+    vault_key = os.path.normpath(os.path.abspath(vault_name))
+    watcher = _vault_watchers.get(vault_key)
+    if watcher is not None and watcher.is_alive():
+        return f"Already watching {vault_name}."
+
+    watcher = VaultWatcher(
+        vault_name, sync_vdb_wit_vault_recursive, interval=interval, debounce=debounce
+    )
+    watcher.start()
+    _vault_watchers[vault_key] = watcher
+    return f"Watching {vault_name}. Notes DB will stay in sync with changes in the vault."
+
+
+def stop_vault_watcher(vault_name):
+    watcher = _vault_watchers.pop(os.path.normpath(os.path.abspath(vault_name)), None)
+    if watcher is None:
+        return f"Not watching {vault_name}."
+    watcher.stop()
+    return f"Stopped watching {vault_name}."
+
+
+def is_vault_watched(vault_name):
+    """True if a watcher on the vault or one of its parents keeps it synced"""
+    vault_key = os.path.normpath(os.path.abspath(vault_name))
+    for watched, watcher in list(_vault_watchers.items()):
+        if watcher.is_alive() and (vault_key == watched or vault_key.startswith(os.path.join(watched, ""))):
+            return True
+    return False
+
+
+def sync_vdb_wit_vault_recursive(vault_name):
+    """
+    Add, update and delete from VDB to match its records with the vault and sub vaults to avoid
+    creating dead link and to not miss out on any potential links
+    """
+
+    try:
+        print(
+            f"Syncing Notes DB with Deletions and Additions in the Vault and Sub Vaults."
+        )
+        return sync_vault_incremental(vault_name, recursive=True)
     except Exception as e:
         print(f"Failed to sync DB with Vault.\nError: {e}")
+        return f"Failed to sync DB with Vault.\nError: {e}"
+
+
+def sync_vdb_wit_vault(vault_name):
+    """
+    Add, update and delete from VDB to match its records with the vault to avoid
+    creating dead link and to not miss out on any potential links
+    """
+
+    try:
+        print(f"Syncing Notes DB with Deletions and Additions in the Vault.")
+        return sync_vault_incremental(vault_name, recursive=False)
+    except Exception as e:
+        print(f"Failed to sync DB with Vault.\nError: {e}")
+        return f"Failed to sync DB with Vault.\nError: {e}"
 
 
 def format_to_MD_and_save(
@@ -200,6 +338,7 @@ def format_to_MD_and_save(
     restrict_to_vault=True,
     MAX_COSINE_DISTANCE=2.0
 ):
+    """write the note to the vault and add it to the notes DB, returns True if both succeeded"""
     try:
         final_md_to_write = tags
 
@@ -238,9 +377,12 @@ def format_to_MD_and_save(
         if restrict_to_vault:
             vdb_notes_collection_where = {"vault_path": {"$eq": vault_name}}
 
+        query_text = final_md_to_write
+        query_embeddings = vdb_handler.embed([query_text])
+
         related_notes = vdb_handler.query_collection(
             vdb_notes_collection_name,
-            query_texts=[final_md_to_write],
+            query_embeddings=query_embeddings,
             n_results=3,
             include=["metadatas", "distances"],
             where=vdb_notes_collection_where,
@@ -266,35 +408,310 @@ def format_to_MD_and_save(
 
         final_md_to_write_without_images = final_md_to_write
 
+        ## the stored vector must match the stored text, the query vector is only reused if nothing was appended
+        if final_md_to_write_without_images == query_text:
+            note_embeddings = query_embeddings
+        else:
+            note_embeddings = vdb_handler.embed([final_md_to_write_without_images])
+
         ## add image if possible
         if reference_image_text:
             final_md_to_write += "\n## Pictures\n" + reference_image_text
 
-        sanitized_stem, sanitized_filename = write_to_markdown(
-            content=final_md_to_write,
-            filename=response_dict["title"],
-            save_dir=vault_name,
-            mode="w",
-            encoding="utf-8",
-        )
+        ## hold the sync lock so a watcher sync never sees the note before it is in the DB and manifest
+        with _sync_lock:
+            sanitized_stem, sanitized_filename = write_to_markdown(
+                content=final_md_to_write,
+                filename=response_dict["title"],
+                save_dir=vault_name,
+                mode="w",
+                encoding="utf-8",
+            )
 
-        print(f"ADDED: {sanitized_stem}\nFULL PATH: {sanitized_filename}")
+            print(f"ADDED: {sanitized_stem}\nFULL PATH: {sanitized_filename}")
+
+            note_id = generate_unique_id()
+
+            # add to notes vector DB
+            vdb_handler.add_to_collection(
+                vdb_notes_collection_name,
+                ids=[note_id],
+                documents=[final_md_to_write_without_images],
+                embeddings=note_embeddings,
+                metadatas=[
+                    {
+                        "title": sanitized_stem,
+                        "vault_path": vault_name,
+                        "vault_dir": os.path.basename(vault_name),
+                    }
+                ],
+            )
 
-        # add to notes vector DB
-        vdb_handler.add_to_collection(
-            vdb_notes_collection_name,
-            ids=[generate_unique_id()],
-            documents=[final_md_to_write_without_images],
-            metadatas=[
-                {
-                    "title": sanitized_stem,
-                    "vault_path": vault_name,
-                    "vault_dir": os.path.basename(vault_name),
-                }
-            ],
-        )
+            ## keep the vault manifest in step so the next sync skips this note
+            record_note_in_manifest(sanitized_filename, note_id, final_md_to_write)
     except Exception as e:
         print(f"ERROR in format_to_MD_and_save:\n{e}")
+        return False
+
+    return True
+
+
+def prefetch_chunk_contexts(chunks, vault_name, restrict_to_vault=True, MAX_COSINE_DISTANCE=2.0, batch_size=64, chunk_embeddings=None):
+    """
+    query chunk DB for every chunk of a document in a few batched calls.
+    chunk_embeddings computed at ingest are reused so the chunks are not embedded again.
+    Returns a dict of chunk hash -> query results used by retrieve_chunk_context.
+    """
+    vdb_collection_where = None
+    if restrict_to_vault:
+        vdb_collection_where = {"vault_path": {"$eq": vault_name}}
+
+    ## query each distinct chunk once
+    unique_chunks = {}
+    unique_embeddings = {}
+    for idx, chunk in enumerate(chunks):
+        chunk_hash = generate_unique_hash(chunk)
+        if chunk_hash not in unique_chunks:
+            unique_chunks[chunk_hash] = chunk
+            if chunk_embeddings is not None:
+                unique_embeddings[chunk_hash] = chunk_embeddings[idx]
+
+    start_time = time.time()
+    per_chunk_results = vdb_handler.query_collection_batched(
+        vdb_collection_name,
+        query_texts=list(unique_chunks.values()),
+        query_embeddings=list(unique_embeddings.values()) if chunk_embeddings is not None else None,
+        n_results=5,
+        include=["documents", "distances", "metadatas"],
+        where=vdb_collection_where,
+        max_distance=MAX_COSINE_DISTANCE,
+        batch_size=batch_size
+    )
+    print(f'TIME TAKEN to retrieve context for {len(unique_chunks)} chunks: {time.time() - start_time}')
+
+    return dict(zip(unique_chunks.keys(), per_chunk_results))
+
+
+def add_group_members(results, members):
+    """
+    put the member chunks of a planned topic group in front of the retrieved context, so the
+    prompt is built from the group itself and every member is recorded as used.
+    Retrieved copies of a member are dropped, the image references of the members are kept as metadata.
+    """
+    member_hashes = {generate_unique_hash(member) for member in members}
+    keep = [
+        idx for idx, doc in enumerate(results["documents"][0])
+        if generate_unique_hash(doc) not in member_hashes
+    ]
+    member_values = {
+        "documents": list(members),
+        "distances": [0.0] * len(members),
+        "metadatas": [
+            {tag: tag[len("<reference image "):-1] for tag in re.findall(r"<reference image [^>]*>", member)}
+            for member in members
+        ],
+    }
+
+    grouped = {}
+    for field, value in results.items():
+        if field == "included" or not isinstance(value, list) or value[0] is None:
+            grouped[field] = value
+            continue
+        grouped[field] = [member_values.get(field, [None] * len(members)) + [value[0][idx] for idx in keep]]
+    return grouped
+
+
+def retrieve_chunk_context(chunk, vault_name, restrict_to_vault=True, MAX_COSINE_DISTANCE=2.0, prefetched=None, members=None):
+    """
+    query chunk DB to get the context for a chunk, using prefetched results when available.
+    members are the chunks a planned topic group was merged from, they lead the context.
+    """
+    results = None
+    if prefetched is not None:
+        results = prefetched.get(generate_unique_hash(chunk))
+
+    if results is None:
+        vdb_collection_where = None
+        if restrict_to_vault:
+            vdb_collection_where = {"vault_path": {"$eq": vault_name}}
+
+        results = vdb_handler.query_collection(
+            vdb_collection_name,
+            query_texts=[chunk],
+            n_results=5,
+            include=["documents", "distances", "metadatas"],
+            where=vdb_collection_where,
+            max_distance=MAX_COSINE_DISTANCE
+        )
+
+    if members:
+        results = add_group_members(results, members)
+
+    context_metadata = merge_dicts(results["metadatas"][0])
+
+    return results, context_metadata
+
+
+def build_chunk_prompt(results, provider, model_name):
+    """join the retrieved chunks in rank order, within the prompt token budget of the provider"""
+    user_prompt, _ = PromptBuilder(provider, model_name).build_notes_prompt(
+        results["documents"][0], system_prompt=system_prompt
+    )
+    return user_prompt
+
+
+def generate_chunk_response(user_prompt, provider, model_name, MAX_LLM_RETRY=3, sleep_time=0):
+    """Use LLM to generate a note for the given context, returns the parsed dict or None"""
+
+    llm = LLMHandler(provider=provider, model_name=model_name)
+
+    retry_counter = 0
+    response_dict = None
+    ## provider rate limits are handled by LLMHandler, sleep_time is only an extra cool down
+    if sleep_time:
+        time.sleep(sleep_time)
+    while retry_counter < MAX_LLM_RETRY and not isinstance(
+        response_dict, dict
+    ):
+        retry_counter += 1
+        try:
+            ## a cached response that failed to parse must not be served again on retry
+            response = llm.generate(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                bypass_cache=retry_counter > 1,
+            )
+            print(f'LLM generation complete: attempt {retry_counter}')
+            response_dict = extract_and_parse_json(response)
+            print(f'succesfully converted LLM response to dict on attempt {retry_counter}')
+        except Exception as e:
+            print(f"^^^^^^^^^ERROR in LLM generation on attempt {retry_counter}: {e}")
+
+    if not isinstance(response_dict, dict):
+        return None
+
+    return response_dict
+
+
+async def agenerate_chunk_response(user_prompt, provider, model_name, MAX_LLM_RETRY=3, sleep_time=0):
+    """Async counterpart of generate_chunk_response, waits on the event loop instead of a thread"""
+
+    llm = LLMHandler(provider=provider, model_name=model_name)
+
+    retry_counter = 0
+    response_dict = None
+    if sleep_time:
+        await asyncio.sleep(sleep_time)
+    while retry_counter < MAX_LLM_RETRY and not isinstance(
+        response_dict, dict
+    ):
+        retry_counter += 1
+        try:
+            response = await llm.agenerate(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                bypass_cache=retry_counter > 1,
+            )
+            print(f'LLM generation complete: attempt {retry_counter}')
+            response_dict = extract_and_parse_json(response)
+            print(f'succesfully converted LLM response to dict on attempt {retry_counter}')
+        except Exception as e:
+            print(f"^^^^^^^^^ERROR in LLM generation on attempt {retry_counter}: {e}")
+
+    if not isinstance(response_dict, dict):
+        return None
+
+    return response_dict
+
+
+def save_chunk_note(
+    response_dict,
+    context_metadata,
+    chunk_number,
+    vault_name,
+    tags="",
+    restrict_to_vault=True,
+    MAX_COSINE_DISTANCE=2.0
+):
+    """resolve image references and write the generated note to the vault, returns True if it was saved"""
+
+    ## replace image <reference > label with the image loaded from the blob store
+    reference_image_text = replace_references(
+        text=response_dict.get("reference image"),
+        reference_dict=context_metadata,
+        resolver=resolve_image_reference,
+    )
+    print(f'DONE: replace image <reference > label with its embedding')
+
+    ## add generated tags
+    all_tags = tags + ' '+ response_dict.get("tags", "")
+
+    response_dict["title"] = f'{chunk_number}__{response_dict.get("title")}'
+
+    return format_to_MD_and_save(
+        response_dict=response_dict,
+        context_metadata=context_metadata,
+        vault_name=vault_name,
+        reference_image_text=reference_image_text,
+        tags=all_tags,
+        restrict_to_vault=restrict_to_vault,
+        MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
+    )
+
+
+def save_generated_note(
+    response_dict,
+    chunk,
+    chunk_number,
+    context_metadata,
+    vault_name,
+    stats,
+    tags="",
+    restrict_to_vault=True,
+    MAX_COSINE_DISTANCE=2.0
+):
+    """
+    save step shared by the note generation drivers: skips an invalid LLM response,
+    otherwise saves the note and counts it in stats. Returns True if the note was saved.
+    """
+    if response_dict is None:
+        print(
+            f"+++++++++++++++++++SKIPPING due to invalid LLM response:\nCHUNK: {chunk}"
+        )
+        return False
+
+    if not save_chunk_note(
+        response_dict=response_dict,
+        context_metadata=context_metadata,
+        chunk_number=chunk_number,
+        vault_name=vault_name,
+        tags=tags,
+        restrict_to_vault=restrict_to_vault,
+        MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
+    ):
+        return False
+
+    stats["notes_saved"] += 1
+    return True
+
+
+def new_run_stats(chunks):
+    return {
+        "chunks": len(chunks),
+        "generation_requests": 0,
+        "notes_saved": 0,
+        "skipped_exact_duplicates": 0,
+        "skipped_near_duplicates": 0,
+        "saved_llm_calls": 0,
+    }
+
+
+def report_run_stats(stats, used_chunks):
+    """fill in the dedup counts, every skipped duplicate is an LLM call that was not made"""
+    stats["skipped_exact_duplicates"] = used_chunks.exact_skips
+    stats["skipped_near_duplicates"] = used_chunks.near_skips
+    stats["saved_llm_calls"] = used_chunks.skipped
+    print("RUN STATS: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
 
 
 def generate_notes(
@@ -303,17 +720,69 @@ def generate_notes(
     provider,
     model_name,
     MAX_LLM_RETRY=3,
-    sleep_time=5,
+    sleep_time=0,
     tags="",
     restrict_to_vault=True,
-    MAX_COSINE_DISTANCE=2.0
+    MAX_COSINE_DISTANCE=2.0,
+    max_workers=1,
+    chunk_embeddings=None,
+    use_async=False,
+    chunk_members=None
 ):
-    """iterate through those chunks and generate notes"""
+    """
+    iterate through those chunks and generate notes.
+    chunk_embeddings (aligned with chunks) from store_doc_to_vector_db avoid re-embedding the chunks.
+    chunk_members (aligned with chunks) are the member chunks of topic groups from plan_note_groups.
+    use_async keeps max_workers requests in flight on one event loop instead of a thread each.
+    Returns the run statistics, including the LLM calls saved by skipping duplicate chunks.
+    """
 
+    if use_async:
+        return run_async(
+            agenerate_notes(
+                chunks=chunks,
+                vault_name=vault_name,
+                provider=provider,
+                model_name=model_name,
+                MAX_LLM_RETRY=MAX_LLM_RETRY,
+                sleep_time=sleep_time,
+                tags=tags,
+                restrict_to_vault=restrict_to_vault,
+                MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+                max_in_flight=max_workers,
+                chunk_embeddings=chunk_embeddings,
+                chunk_members=chunk_members
+            )
+        )
+
+    if max_workers > 1:
+        return generate_notes_concurrently(
+            chunks=chunks,
+            vault_name=vault_name,
+            provider=provider,
+            model_name=model_name,
+            MAX_LLM_RETRY=MAX_LLM_RETRY,
+            sleep_time=sleep_time,
+            tags=tags,
+            restrict_to_vault=restrict_to_vault,
+            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            max_workers=max_workers,
+            chunk_embeddings=chunk_embeddings,
+            chunk_members=chunk_members
+        )
+
+    stats = new_run_stats(chunks)
     try:
-        used_chunks = (
-            []
-        )  ## if a string is present in this then skip(use generate_unique_hash for encoding)
+        used_chunks = ChunkDeduplicator()  ## chunks already covered by a note, exact copies and near duplicates are skipped
+
+        ## embed and query all chunks up front in batches
+        prefetched = prefetch_chunk_contexts(
+            chunks,
+            vault_name,
+            restrict_to_vault=restrict_to_vault,
+            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            chunk_embeddings=chunk_embeddings
+        )
 
         # fo a vector search on chunk iteratively
         for idx, chunk in enumerate(chunks):
@@ -325,98 +794,468 @@ def generate_notes(
 
             try:
                 ## chek if this chunk can be skipped
-                chunk_hash = generate_unique_hash(chunk)
-
-                if chunk_hash in used_chunks:
-                    print(f"++++++SKIPPING since this chunk was already used.")
+                if used_chunks.is_duplicate(chunk):
+                    print(f"++++++SKIPPING since this chunk (or a near duplicate) was already used.")
                     continue
 
-                ## query chunk DB to get context
-                vdb_collection_where = None
-                if restrict_to_vault:
-                    vdb_collection_where = {"vault_path": {"$eq": vault_name}}
-
-                results = vdb_handler.query_collection(
-                    vdb_collection_name,
-                    query_texts=[chunk],
-                    n_results=5,
-                    include=["documents", "distances", "metadatas"],
-                    where=vdb_collection_where,
-                    max_distance=MAX_COSINE_DISTANCE
+                results, context_metadata = retrieve_chunk_context(
+                    chunk,
+                    vault_name,
+                    restrict_to_vault=restrict_to_vault,
+                    MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+                    prefetched=prefetched,
+                    members=chunk_members[idx] if chunk_members else None
                 )
 
-                context_metadata = merge_dicts(results["metadatas"][0])
-
-                if len(context_metadata) == 0:
+                if len(results["documents"][0]) == 0:
                     print(
                         f"+++++++++++++SKIPPING due to no related chunks in vector DB:\n{chunk}"
                     )
                     continue
 
                 ## Use LLM to generate notes
-                user_prompt = "\n".join(results["documents"][0])
-
-                llm = LLMHandler(provider=provider, model_name=model_name)
+                user_prompt = build_chunk_prompt(results, provider, model_name)
+
+                stats["generation_requests"] += 1
+                response_dict = generate_chunk_response(
+                    user_prompt,
+                    provider,
+                    model_name,
+                    MAX_LLM_RETRY=MAX_LLM_RETRY,
+                    sleep_time=sleep_time
+                )
 
-                retry_counter = 0
-                response_dict = None
-                ## sleep between request to API to avoid hitting rate limit
-                time.sleep(sleep_time)
-                while retry_counter < MAX_LLM_RETRY and not isinstance(
-                    response_dict, dict
+                if not save_generated_note(
+                    response_dict,
+                    chunk,
+                    chunk_number,
+                    context_metadata,
+                    vault_name,
+                    stats,
+                    tags=tags,
+                    restrict_to_vault=restrict_to_vault,
+                    MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
                 ):
-                    retry_counter += 1
-                    try:
-                        response = llm.generate(
-                            system_prompt=system_prompt, user_prompt=user_prompt
-                        )
-                        print(f'LLM generation complete: attempt {retry_counter}')
-                        response_dict = extract_and_parse_json(response)
-                        print(f'succesfully converted LLM response to dict on attempt {retry_counter}')
-                    except Exception as e:
-                        print(f"^^^^^^^^^ERROR in LLM generation on attempt {retry_counter}: {e}")
+                    continue
+
+                ## record the chunk
+                used_chunks.add(chunk)
+
+                ## record retrieved chunks (and group members) being used to avoid duplication of notes on the same topic
+                for retrieved_chunk in results["documents"][0]:
+                    used_chunks.add(retrieved_chunk)
+
+            except Exception as e:
+                print(f"ERROR while generating note for the chunk:{chunk}\nreason:{e}")
+
+        report_run_stats(stats, used_chunks)
+
+    except Exception as e:
+        print(f"ERROR while generating notes : {e} ")
+
+    return stats
+
+
+def plan_chunk_notes(
+    chunks,
+    vault_name,
+    restrict_to_vault=True,
+    MAX_COSINE_DISTANCE=2.0,
+    chunk_embeddings=None,
+    used_chunks=None,
+    prefetched=None,
+    indices=None,
+    skipped=None,
+    chunk_members=None
+):
+    """
+    Retrieval and used_chunks dedup, sequentially in chunk order.
+    used_chunks is the ChunkDeduplicator to record skipped duplicates in.
+    indices limits planning to those chunk positions, the positions skipped as duplicates are appended to skipped.
+    Returns the (chunk_number, chunk, results, context_metadata, reserved) tuples to generate notes for,
+    reserved being the texts the note reserved in used_chunks.
+    """
+    if used_chunks is None:
+        used_chunks = ChunkDeduplicator()
+    if indices is None:
+        indices = range(len(chunks))
+    planned = []  ## (chunk_number, chunk, results, context_metadata, reserved)
+
+    ## embed and query all chunks up front in batches
+    if prefetched is None:
+        prefetched = prefetch_chunk_contexts(
+            chunks,
+            vault_name,
+            restrict_to_vault=restrict_to_vault,
+            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            chunk_embeddings=chunk_embeddings
+        )
+
+    # ==========retrieval===========
+    for idx in indices:
+        chunk = chunks[idx]
+        chunk_number = idx+1
+
+        try:
+            if used_chunks.is_duplicate(chunk):
+                print(f"++++++SKIPPING {chunk_number}/{len(chunks)} since this chunk (or a near duplicate) was already used.")
+                if skipped is not None:
+                    skipped.append(idx)
+                continue
+
+            results, context_metadata = retrieve_chunk_context(
+                chunk,
+                vault_name,
+                restrict_to_vault=restrict_to_vault,
+                MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+                prefetched=prefetched,
+                members=chunk_members[idx] if chunk_members else None
+            )
+
+            if len(results["documents"][0]) == 0:
+                print(
+                    f"+++++++++++++SKIPPING due to no related chunks in vector DB:\n{chunk}"
+                )
+                continue
+
+            ## reserve the chunk and its context up front since generation happens later
+            reserved = [chunk] + list(results["documents"][0])
+            for text in reserved:
+                used_chunks.add(text)
+
+            planned.append((chunk_number, chunk, results, context_metadata, reserved))
+
+        except Exception as e:
+            print(f"ERROR while retrieving context for the chunk:{chunk}\nreason:{e}")
+
+    return planned
+
+
+def release_failed_reservations(failed, skipped, used_chunks, skips_before):
+    """
+    Planning reserves a chunk and its context before the note is generated. Drop the
+    reservations of the notes that failed and return the skipped chunk positions to plan
+    again, so like in a sequential run a failed note doesn't stop its duplicates from getting one.
+    Reservations are counted, a text another note also reserved stays used.
+    skips_before are the (exact, near) skip counts before the round, the re-planned chunks
+    are only counted once.
+    """
+    if not failed:
+        return []
+
+    for *_, reserved in failed:
+        for text in reserved:
+            used_chunks.remove(text)
+
+    used_chunks.exact_skips, used_chunks.near_skips = skips_before
+    return skipped
+
+
+def generate_notes_concurrently(
+    chunks,
+    vault_name,
+    provider,
+    model_name,
+    MAX_LLM_RETRY=3,
+    sleep_time=0,
+    tags="",
+    restrict_to_vault=True,
+    MAX_COSINE_DISTANCE=2.0,
+    max_workers=4,
+    chunk_embeddings=None,
+    chunk_members=None
+):
+    """
+    Generate notes with up to max_workers LLM requests in flight.
+
+    Runs in three stages so the output stays deterministic:
+        1. retrieval and used_chunks dedup, sequentially in chunk order
+        2. LLM generation on a thread pool
+        3. format_to_MD_and_save, sequentially in chunk order
+    If notes fail, their reservations are released and the chunks skipped in that round are planned again.
+    """
+
+    stats = new_run_stats(chunks)
+    used_chunks = ChunkDeduplicator()
+    try:
+        ## embed and query all chunks up front in batches, reused by every round
+        prefetched = prefetch_chunk_contexts(
+            chunks,
+            vault_name,
+            restrict_to_vault=restrict_to_vault,
+            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            chunk_embeddings=chunk_embeddings
+        )
 
-                if not isinstance(response_dict, dict):
+        pending = range(len(chunks))
+        while pending:
+            skips_before = (used_chunks.exact_skips, used_chunks.near_skips)
+            skipped = []
+            planned = plan_chunk_notes(
+                chunks,
+                vault_name,
+                restrict_to_vault=restrict_to_vault,
+                MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+                used_chunks=used_chunks,
+                prefetched=prefetched,
+                indices=pending,
+                skipped=skipped,
+                chunk_members=chunk_members
+            )
+            stats["generation_requests"] += len(planned)
+
+            print(f"Generating {len(planned)} notes from {len(chunks)} chunks with {max_workers} workers.")
+
+            failed = []
+            # ==========generation===========
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        generate_chunk_response,
+                        build_chunk_prompt(results, provider, model_name),
+                        provider,
+                        model_name,
+                        MAX_LLM_RETRY=MAX_LLM_RETRY,
+                        sleep_time=sleep_time
+                    )
+                    for _, _, results, _, _ in planned
+                ]
+
+                # ==========saving===========
+                for planned_note, future in zip(planned, futures):
+                    chunk_number, chunk, results, context_metadata, _ = planned_note
                     print(
-                        f"+++++++++++++++++++SKIPPING due to invalid LLM response:\nCHUNK: {chunk}\nresponse_dict: {response_dict}"
+                        f"==============SAVING {chunk_number}/{len(chunks)}===================================="
                     )
-                    continue
+                    try:
+                        if not save_generated_note(
+                            future.result(),
+                            chunk,
+                            chunk_number,
+                            context_metadata,
+                            vault_name,
+                            stats,
+                            tags=tags,
+                            restrict_to_vault=restrict_to_vault,
+                            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
+                        ):
+                            failed.append(planned_note)
+                    except Exception as e:
+                        print(f"ERROR while generating note for the chunk:{chunk}\nreason:{e}")
+                        failed.append(planned_note)
 
-                ## replace image <reference > label with its embedding
-                reference_image_text = replace_references(
-                    text=response_dict.get("reference image"),
-                    reference_dict=context_metadata,
-                )
-                print(f'DONE: replace image <reference > label with its embedding')
+            pending = release_failed_reservations(failed, skipped, used_chunks, skips_before)
+
+        report_run_stats(stats, used_chunks)
 
-                ## add generated tags
-                all_tags = tags + ' '+ response_dict.get("tags", "")
+    except Exception as e:
+        print(f"ERROR while generating notes : {e} ")
 
-                response_dict["title"] = f'{chunk_number}__{response_dict.get("title")}'
+    return stats
 
-                format_to_MD_and_save(
-                    response_dict=response_dict,
-                    context_metadata=context_metadata,
-                    vault_name=vault_name,
-                    reference_image_text=reference_image_text,
-                    tags=all_tags,
-                    restrict_to_vault=restrict_to_vault,
-                    MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
+
+async def agenerate_notes(
+    chunks,
+    vault_name,
+    provider,
+    model_name,
+    MAX_LLM_RETRY=3,
+    sleep_time=0,
+    tags="",
+    restrict_to_vault=True,
+    MAX_COSINE_DISTANCE=2.0,
+    max_in_flight=8,
+    chunk_embeddings=None,
+    chunk_members=None
+):
+    """
+    Generate notes with up to max_in_flight LLM requests in flight on one event loop.
+
+    Same stages as generate_notes_concurrently: retrieval and saving run in chunk order
+    on a worker thread (ChromaDB is synchronous), only generation is async.
+    """
+
+    stats = new_run_stats(chunks)
+    used_chunks = ChunkDeduplicator()
+    try:
+        prefetched = await asyncio.to_thread(
+            prefetch_chunk_contexts,
+            chunks,
+            vault_name,
+            restrict_to_vault=restrict_to_vault,
+            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            chunk_embeddings=chunk_embeddings
+        )
+
+        semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+        async def generate(results):
+            async with semaphore:
+                return await agenerate_chunk_response(
+                    build_chunk_prompt(results, provider, model_name),
+                    provider,
+                    model_name,
+                    MAX_LLM_RETRY=MAX_LLM_RETRY,
+                    sleep_time=sleep_time
                 )
 
-                ## record the chunk
-                used_chunks.append(chunk_hash)
+        pending = range(len(chunks))
+        while pending:
+            skips_before = (used_chunks.exact_skips, used_chunks.near_skips)
+            skipped = []
+            planned = await asyncio.to_thread(
+                plan_chunk_notes,
+                chunks,
+                vault_name,
+                restrict_to_vault=restrict_to_vault,
+                MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+                used_chunks=used_chunks,
+                prefetched=prefetched,
+                indices=pending,
+                skipped=skipped,
+                chunk_members=chunk_members
+            )
+            stats["generation_requests"] += len(planned)
 
-                ## record retrieved chunks being used to avoid duplication of notes on the same topic
-                for retrieved_chunk in results["documents"][0]:
-                    used_chunks.append(generate_unique_hash(retrieved_chunk))
+            print(f"Generating {len(planned)} notes from {len(chunks)} chunks with {max_in_flight} requests in flight.")
 
-            except Exception as e:
-                print(f"ERROR while generating note for the chunk:{chunk}\nreason:{e}")
+            # ==========generation===========
+            tasks = [asyncio.create_task(generate(results)) for _, _, results, _, _ in planned]
+
+            failed = []
+            # ==========saving===========
+            for planned_note, task in zip(planned, tasks):
+                chunk_number, chunk, results, context_metadata, _ = planned_note
+                print(
+                    f"==============SAVING {chunk_number}/{len(chunks)}===================================="
+                )
+                try:
+                    if not await asyncio.to_thread(
+                        save_generated_note,
+                        await task,
+                        chunk,
+                        chunk_number,
+                        context_metadata,
+                        vault_name,
+                        stats,
+                        tags=tags,
+                        restrict_to_vault=restrict_to_vault,
+                        MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
+                    ):
+                        failed.append(planned_note)
+                except Exception as e:
+                    print(f"ERROR while generating note for the chunk:{chunk}\nreason:{e}")
+                    failed.append(planned_note)
+
+            pending = release_failed_reservations(failed, skipped, used_chunks, skips_before)
+
+        report_run_stats(stats, used_chunks)
 
     except Exception as e:
         print(f"ERROR while generating notes : {e} ")
 
+    return stats
+
+
+def plan_note_groups(chunks, chunk_embeddings, provider, model_name, chunks_per_group=4):
+    """
+    Planning pass before any LLM call: cluster the chunks of a document by topic and
+    merge every group into one chunk, so each group gets a single note request.
+
+    Returns:
+        (group texts, group centroid embeddings, group member chunks), usable as chunks,
+        chunk_embeddings and chunk_members for generate_notes
+    """
+    groups, centroids = plan_chunk_groups(chunks, chunk_embeddings, chunks_per_group=chunks_per_group)
+
+    estimate = estimate_plan_cost(
+        groups,
+        chunks,
+        system_prompt=system_prompt,
+        max_prompt_tokens=PromptBuilder(provider, model_name).max_tokens,
+    )
+    print(
+        f"PLAN: {estimate['chunks']} chunks -> {len(groups)} topic groups. "
+        f"Estimated {estimate['llm_calls']} LLM calls (instead of {estimate['llm_calls_without_plan']}) "
+        f"and ~{estimate['prompt_tokens']} prompt tokens."
+    )
+
+    group_members = [[chunks[idx] for idx in members] for members in groups]
+    group_texts = ["\n".join(members) for members in group_members]
+    return group_texts, list(centroids), group_members
+
+
+## documents a conversion worker converts per task through docling's convert_all
+DOCS_PER_CONVERSION_TASK = int(os.environ.get("DOCS_PER_CONVERSION_TASK", 2))
+
+
+def iter_converted_docs(source_files, conversion_workers=1):
+    """
+    Yield (source_file, md_content) in order while PDFs/PPTX are converted to markdown with
+    docling's batch convert_all. With conversion_workers > 1 a process pool converts batches of
+    upcoming documents, so conversion of the next files overlaps note generation for this one.
+    md_content is None for .md files or if the conversion failed, in which case it is retried
+    inline by store_doc_to_vector_db.
+    """
+
+    source_files = list(source_files)
+
+    if conversion_workers <= 1:
+        converted = convert_all(f for f in source_files if not f.lower().endswith(".md"))
+        for source_file in source_files:
+            md_content = None
+            if not source_file.lower().endswith(".md"):
+                _, md_content = next(converted)
+            yield source_file, md_content
+        return
+
+    num_threads = max(1, (os.cpu_count() or 1) // conversion_workers)
+
+    ## spawn, not fork: a forked worker would inherit the parent's converter and CUDA state,
+    ## which can't be re-initialized in a forked process
+    with ProcessPoolExecutor(
+        max_workers=conversion_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_conversion_worker,
+        initargs=(num_threads,),
+    ) as executor:
+        pending = deque()  ## (source_file, future of its batch, position in the batch)
+        remaining = iter(source_files)
+
+        def submit_next():
+            """queue the files up to and including the next batch of documents to convert"""
+            queued, batch = [], []
+            for source_file in remaining:
+                queued.append(source_file)
+                if not source_file.lower().endswith(".md"):
+                    batch.append(source_file)
+                    if len(batch) == DOCS_PER_CONVERSION_TASK:
+                        break
+            future = executor.submit(convert_batch, batch) if batch else None
+            for source_file in queued:
+                if source_file.lower().endswith(".md"):
+                    pending.append((source_file, None, None))
+                else:
+                    pending.append((source_file, future, batch.index(source_file)))
+
+        ## keep a bounded number of converted batches ahead of the consumer
+        for _ in range(conversion_workers * 2):
+            submit_next()
+
+        while pending:
+            source_file, future, position = pending.popleft()
+            if position == 0:
+                submit_next()
+
+            md_content = None
+            if future is not None:
+                try:
+                    md_content = future.result()[position]
+                except Exception as e:
+                    print(f"ERROR while converting {source_file} to MD in worker: {e}")
+
+            yield source_file, md_content
+
 
 def main(
     source,
@@ -428,21 +1267,39 @@ def main(
     sleep_time,
     tags,
     restrict_to_vault=True,
-    MAX_COSINE_DISTANCE=0.2
+    MAX_COSINE_DISTANCE=0.2,
+    max_workers=1,
+    conversion_workers=1,
+    use_async=False,
+    chunks_per_group=1
 ):
 
-    ## sync the noted DB(used for creating links) with changes in vault
-    sync_vdb_wit_vault(vault_name)
+    ## sync the noted DB(used for creating links) with changes in vault, unless a watcher already does
+    if not is_vault_watched(vault_name):
+        sync_vdb_wit_vault(vault_name)
     
     ## handle for directory
     all_files_to_process = process_path(source)
     
-    ## store doc in vector DB
-    for source_file in all_files_to_process:
-        chunks = store_doc_to_vector_db(
-            source_file, vault_name, filter_on_headers=filter_on_headers
+    ## store doc in vector DB, conversion of the next docs runs in the background
+    for source_file, md_content in iter_converted_docs(
+        all_files_to_process, conversion_workers=conversion_workers
+    ):
+        chunks, chunk_embeddings = store_doc_to_vector_db(
+            source_file,
+            vault_name,
+            filter_on_headers=filter_on_headers,
+            md_content=md_content,
+            return_embeddings=True,
         )
 
+        ## group chunks by topic so every group gets one LLM request instead of every chunk
+        chunk_members = None
+        if chunks_per_group > 1 and chunks and chunk_embeddings is not None:
+            chunks, chunk_embeddings, chunk_members = plan_note_groups(
+                chunks, chunk_embeddings, provider, model_name, chunks_per_group=chunks_per_group
+            )
+
         generate_notes(
             chunks=chunks,
             vault_name=vault_name,
@@ -452,7 +1309,11 @@ def main(
             sleep_time=sleep_time,
             tags=tags,
             restrict_to_vault=restrict_to_vault,
-            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE
+            MAX_COSINE_DISTANCE=MAX_COSINE_DISTANCE,
+            max_workers=max_workers,
+            chunk_embeddings=chunk_embeddings,
+            use_async=use_async,
+            chunk_members=chunk_members
         )
 
     print("======NOTE GENERATION COMPLETE=======")
@@ -463,7 +1324,7 @@ if __name__ == "__main__":
     ###=========user input=================
     filter_on_headers = True
     MAX_LLM_RETRY = 3
-    sleep_time = 5
+    sleep_time = 0
     source = r"C:\Users\yusuf\Downloads\my projects\PDF2Obsidian_notes\sample_pdfs\A tactile discrimination task to study neuronal dynamics in freely.pdf"
     vault_name = r"C:\Users\yusuf\Downloads\my projects\PDF2Obsidian_notes\sample_vault"
 
@@ -0,0 +1,234 @@
+import numpy as np
+import networkx as nx
+
+
+class CSRGraph:
+    """
+    Compact graph of a vault: integer node ids, CSR adjacency arrays and a side table of titles.
+
+    - titles (list): node id -> note key
+    - indptr (np.ndarray): neighbours of node i are indices[indptr[i]:indptr[i + 1]]
+    - indices (np.ndarray): concatenated neighbour ids
+
+    Traversals expand a whole BFS frontier at once with NumPy instead of walking
+    dict-of-dicts adjacency in Python.
+    """
+
+    def __init__(self, titles, indptr, indices, directed=False):
+        self.titles = list(titles)
+        self.node_ids = {title: i for i, title in enumerate(self.titles)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.directed = directed
+
+    def __contains__(self, node):
+        return node in self.node_ids
+
+    def __len__(self):
+        return len(self.titles)
+
+    def number_of_nodes(self):
+        return len(self.titles)
+
+    def number_of_edges(self):
+        n_entries = len(self.indices)
+        return n_entries if self.directed else n_entries // 2
+
+    def neighbors(self, node):
+        """Same contract as networkx, so obsidian_graph.utils.bfs_upto_levels works unchanged"""
+        i = self.node_ids[node]
+        return (self.titles[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]])
+
+    def _expand(self, frontier):
+        """Return (neighbour ids, id of the frontier node each neighbour was reached from)"""
+        starts = self.indptr[frontier]
+        lengths = self.indptr[frontier + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        ## position of every neighbour entry in indices, without a Python loop over the frontier
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return self.indices[offsets].astype(np.int64), np.repeat(frontier, lengths)
+
+    def bfs_upto_levels(self, start_node, max_levels):
+        """
+        Nodes reachable from start_node within max_levels hops.
+
+        Returns:
+            list: (node, level) tuples in BFS order, like obsidian_graph.utils.bfs_upto_levels
+        """
+        start = self.node_ids[start_node]
+        visited = np.zeros(len(self.titles), dtype=bool)
+        visited[start] = True
+
+        result = [(start_node, 0)]
+        frontier = np.array([start], dtype=np.int64)
+
+        for level in range(1, max_levels + 1):
+            neighbours, _ = self._expand(frontier)
+            neighbours = np.unique(neighbours[~visited[neighbours]])
+            if len(neighbours) == 0:
+                break
+            visited[neighbours] = True
+            result.extend((self.titles[i], level) for i in neighbours)
+            frontier = neighbours
+
+        return result
+
+    def shortest_path(self, source, target):
+        """
+        Bidirectional BFS shortest path between two notes.
+
+        Returns:
+            list: note keys from source to target
+
+        Raises:
+            nx.NetworkXNoPath: if target is not reachable from source
+        """
+        if source not in self.node_ids or target not in self.node_ids:
+            raise nx.NodeNotFound(f"Either source {source} or target {target} is not in the graph")
+
+        src, dst = self.node_ids[source], self.node_ids[target]
+        if src == dst:
+            return [source]
+
+        n = len(self.titles)
+        ## reverse adjacency for directed graphs, an undirected graph is its own reverse
+        backward_graph = self if not self.directed else self._reversed()
+
+        dist = [np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64)]
+        parent = [np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64)]
+        dist[0][src] = 0
+        dist[1][dst] = 0
+        frontiers = [np.array([src], dtype=np.int64), np.array([dst], dtype=np.int64)]
+        graphs = [self, backward_graph]
+
+        while len(frontiers[0]) and len(frontiers[1]):
+            ## expand the smaller frontier by one full level
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            neighbours, reached_from = graphs[side]._expand(frontiers[side])
+
+            new = dist[side][neighbours] < 0
+            neighbours, reached_from = neighbours[new], reached_from[new]
+            neighbours, first = np.unique(neighbours, return_index=True)
+
+            level = dist[side][frontiers[side][0]] + 1
+            dist[side][neighbours] = level
+            parent[side][neighbours] = reached_from[first]
+            frontiers[side] = neighbours
+
+            meeting = neighbours[dist[1 - side][neighbours] >= 0]
+            if len(meeting):
+                total = dist[0][meeting] + dist[1][meeting]
+                middle = int(meeting[np.argmin(total)])
+                return self._join_paths(middle, parent)
+
+        raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+
+    def _join_paths(self, middle, parent):
+        forward = []
+        node = middle
+        while node != -1:
+            forward.append(node)
+            node = parent[0][node]
+        forward.reverse()
+
+        node = parent[1][middle]
+        while node != -1:
+            forward.append(node)
+            node = parent[1][node]
+
+        return [self.titles[i] for i in forward]
+
+    def _reversed(self):
+        rows = np.repeat(np.arange(len(self.titles)), np.diff(self.indptr))
+        return CSRGraph.from_edges(self.titles, self.indices, rows, directed=True)
+
+    @classmethod
+    def from_edges(cls, titles, sources, targets, directed=False):
+        """Build from parallel arrays of edge endpoint ids, duplicate edges and self loops are dropped"""
+        n = len(titles)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        if not directed:
+            sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+
+        keep = sources != targets
+        edges = np.unique(np.stack([sources[keep], targets[keep]], axis=1), axis=0) if keep.any() else np.empty((0, 2), dtype=np.int64)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 0], minlength=n), out=indptr[1:])
+        return cls(titles, indptr, edges[:, 1], directed=directed)
+
+    def updated(self, titles, removed_edges=(), added_edges=()):
+        """
+        Return a copy over the new node list titles with some edges removed and added.
+
+        Existing entries are remapped to the new node ids with NumPy, nodes missing from
+        titles lose their edges. Edges are (title, title) pairs, mirrored when undirected.
+        """
+        node_ids = {title: i for i, title in enumerate(titles)}
+        n = len(titles)
+        remap = np.array([node_ids.get(title, -1) for title in self.titles], dtype=np.int64)
+        rows = remap[np.repeat(np.arange(len(self.titles)), np.diff(self.indptr))]
+        cols = remap[self.indices]
+        keep = (rows >= 0) & (cols >= 0)
+        rows, cols = rows[keep], cols[keep]
+
+        def edge_ids(edges):
+            pairs = np.array([(node_ids[s], node_ids[t]) for s, t in edges], dtype=np.int64).reshape(-1, 2)
+            if not self.directed:
+                pairs = np.concatenate([pairs, pairs[:, ::-1]])
+            return pairs
+
+        removed = edge_ids(removed_edges)
+        if len(removed):
+            keep = ~np.isin(rows * n + cols, removed[:, 0] * n + removed[:, 1])
+            rows, cols = rows[keep], cols[keep]
+
+        added = edge_ids(added_edges)
+        rows = np.concatenate([rows, added[:, 0]])
+        cols = np.concatenate([cols, added[:, 1]])
+
+        ## the entries are already mirrored, so build as directed and restore the flag
+        graph = CSRGraph.from_edges(titles, rows, cols, directed=True)
+        graph.directed = self.directed
+        return graph
+
+    def to_networkx(self):
+        """Export to networkx for compatibility, nodes carry no note metadata"""
+        G = nx.DiGraph() if self.directed else nx.Graph()
+        G.add_nodes_from(self.titles)
+        rows = np.repeat(np.arange(len(self.titles)), np.diff(self.indptr))
+        G.add_edges_from((self.titles[i], self.titles[j]) for i, j in zip(rows, self.indices))
+        return G
+
+
+def build_csr_graph(notes, directed=False):
+    """
+    Constructs a CSRGraph from a collection of notes, the compact counterpart of
+    build_undirected_graph / build_directed_graph.
+
+    Parameters:
+    - notes (dict): note key -> parsed note with 'corrected_wikilinks' as produced by parse_vault.
+    - directed (bool): keep link direction instead of treating links as undirected edges.
+
+    Returns:
+    - CSRGraph: node ids follow the order of notes, metadata stays in the notes dict.
+    """
+    titles = list(notes.keys())
+    node_ids = {title: i for i, title in enumerate(titles)}
+
+    sources, targets = [], []
+    for note_title, data in notes.items():
+        source_id = node_ids[note_title]
+        for linked_note in data.get("corrected_wikilinks", {}).values():
+            target_id = node_ids.get(linked_note)
+            if target_id is not None:
+                sources.append(source_id)
+                targets.append(target_id)
+
+    return CSRGraph.from_edges(titles, sources, targets, directed=directed)
@@ -0,0 +1,217 @@
+import os
+import pickle
+import tempfile
+import threading
+
+from utils.basic_utils import generate_unique_hash
+from obsidian_graph.parser import (
+    WikilinkIndex,
+    get_note_aliases,
+    index_vault,
+    parse_markdown_files,
+    resolve_wikilinks,
+)
+from obsidian_graph.graph_builder import build_undirected_graph
+from obsidian_graph.csr_graph import build_csr_graph
+
+
+def build_graph(notes, backend="networkx"):
+    """undirected link graph of the notes with the networkx or the compact csr backend"""
+    if backend == "csr":
+        return build_csr_graph(notes)
+    return build_undirected_graph(notes)
+
+
+class VaultGraph:
+    """
+    Parsed notes and link graph of a vault, persisted to disk and refreshed incrementally.
+
+    Only notes whose mtime or size changed are re-read and re-parsed, and only their
+    wikilinks are re-resolved unless notes were added or deleted or aliases changed, which
+    can change any link's target. The graph is patched with the edges of the affected notes
+    instead of being rebuilt. Note content is not saved with the graph, it is filled back
+    in from the parse cache after loading.
+    """
+
+    VERSION = 3
+
+    def __init__(self, vault_path, backend="networkx"):
+        self.vault_path = vault_path
+        self.backend = backend
+        self.notes = {}  ## note key -> parsed note, same shape as parse_vault
+        self.file_stats = {}  ## note key -> (mtime, size)
+        self.graph = build_graph({}, backend)
+        self.link_index = None  ## WikilinkIndex of the current notes, rebuilt when the key set changes
+
+    @staticmethod
+    def _link_targets(parsed):
+        return {target for target in parsed.get("corrected_wikilinks", {}).values() if target}
+
+    def refresh(self):
+        """Bring the graph up to date with the vault, returns True if anything changed"""
+        note_paths = index_vault(self.vault_path)
+
+        stats = {}
+        for note_key, full_path in note_paths.items():
+            stat = os.stat(full_path)
+            stats[note_key] = (stat.st_mtime, stat.st_size)
+
+        deleted = [key for key in self.file_stats if key not in stats]
+        added = [key for key in stats if key not in self.file_stats]
+        modified = [key for key in stats if key in self.file_stats and stats[key] != self.file_stats[key]]
+        ## unchanged notes loaded from disk, their content comes back from the parse cache
+        missing_content = [
+            key for key in stats
+            if key in self.file_stats and key not in modified and "content" not in self.notes[key]
+        ]
+
+        if not (deleted or added or modified or missing_content):
+            return False
+
+        to_parse = added + modified
+        parsed_keys = set(to_parse)
+        parsed_notes = parse_markdown_files([note_paths[key] for key in to_parse + missing_content])
+        for note_key in missing_content:
+            self.notes[note_key]["content"] = parsed_notes[note_paths[note_key]]["content"]
+
+        if not (deleted or added or modified):
+            return False
+
+        print(f"Refreshing vault graph: {len(added)} added, {len(modified)} modified, {len(deleted)} deleted.")
+
+        old_targets = {key: self._link_targets(self.notes[key]) for key in modified + deleted}
+        aliases_changed = any(
+            get_note_aliases(self.notes[key].get("metadata"))
+            != get_note_aliases(parsed_notes[note_paths[key]].get("metadata"))
+            for key in modified
+        )
+
+        for note_key in deleted:
+            self.notes.pop(note_key, None)
+        for note_key in to_parse:
+            self.notes[note_key] = parsed_notes[note_paths[note_key]]
+
+        if deleted or added or aliases_changed or self.link_index is None:
+            self.link_index = WikilinkIndex(note_paths.keys(), self.notes)
+        if deleted or added or aliases_changed:
+            ## any link may now point elsewhere, keep the notes whose targets moved
+            for note_key, parsed in self.notes.items():
+                if note_key in old_targets or note_key in parsed_keys:
+                    continue
+                before = self._link_targets(parsed)
+                resolve_wikilinks(parsed, self.link_index, note_paths, source_key=note_key)
+                if self._link_targets(parsed) != before:
+                    old_targets[note_key] = before
+        for note_key in to_parse:
+            resolve_wikilinks(self.notes[note_key], self.link_index, note_paths, source_key=note_key)
+
+        removed_edges, added_edges = set(), set()
+        for note_key in old_targets.keys() | set(added):
+            if note_key not in self.notes:
+                continue  ## deleted, its node takes its edges along
+            before = old_targets.get(note_key, set())
+            after = self._link_targets(self.notes[note_key])
+            added_edges.update((note_key, target) for target in after - before)
+            for target in before - after:
+                ## the edge is undirected, it stays while the target still links back
+                if target in self.notes and note_key not in self._link_targets(self.notes[target]):
+                    removed_edges.add((note_key, target))
+
+        self.file_stats = stats
+        self._update_graph(deleted, to_parse, removed_edges, added_edges)
+        return True
+
+    def _update_graph(self, deleted, to_parse, removed_edges, added_edges):
+        if self.backend == "csr":
+            self.graph = self.graph.updated(list(self.notes.keys()), removed_edges, added_edges)
+            return
+
+        self.graph.remove_nodes_from(deleted)
+        for note_key in to_parse:
+            data = self.notes[note_key]
+            if note_key in self.graph:
+                self.graph.nodes[note_key].clear()
+            self.graph.add_node(note_key, **data["metadata"], tags=data["tags"])
+        self.graph.remove_edges_from(removed_edges)
+        self.graph.add_edges_from(added_edges)
+
+    def save(self, path):
+        """Write adjacency and per-note data atomically, without the note content"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        state = {
+            "version": self.VERSION,
+            "vault_path": self.vault_path,
+            "backend": self.backend,
+            "notes": {
+                key: {field: value for field, value in parsed.items() if field != "content"}
+                for key, parsed in self.notes.items()
+            },
+            "file_stats": self.file_stats,
+            "graph": self.graph,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory or ".", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, vault_path, backend="networkx"):
+        """Load a saved graph, returns an empty one if the file is missing or outdated"""
+        vault_graph = cls(vault_path, backend=backend)
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, OSError, pickle.UnpicklingError, EOFError):
+            return vault_graph
+
+        if (
+            state.get("version") != cls.VERSION
+            or state.get("vault_path") != vault_path
+            or state.get("backend") != backend
+        ):
+            return vault_graph
+
+        vault_graph.notes = state["notes"]
+        vault_graph.file_stats = state["file_stats"]
+        vault_graph.graph = state["graph"]
+        return vault_graph
+
+
+_vault_graphs = {}
+_vault_graphs_lock = threading.Lock()
+
+
+def get_graph_index_path(vault_path, backend="networkx"):
+    """Graph files live in GRAPH_INDEX_DIR, or a vault_graphs directory inside CHROMA_DB_PATH"""
+    graph_dir = os.environ.get(
+        "GRAPH_INDEX_DIR",
+        os.path.join(os.environ.get("CHROMA_DB_PATH", "."), "vault_graphs"),
+    )
+    vault_key = os.path.normpath(os.path.abspath(vault_path))
+    return os.path.join(graph_dir, f"{generate_unique_hash(vault_key)[:20]}_{backend}.pickle")
+
+
+def load_vault_graph(vault_path, backend=None):
+    """
+    Return the up to date VaultGraph of a vault. The graph is kept in memory for the
+    life of the process and on disk between runs, only changed notes are re-parsed.
+    backend is "networkx" or "csr" (compact NumPy graph for large vaults), defaulting
+    to the GRAPH_BACKEND env var.
+    """
+    backend = backend or os.environ.get("GRAPH_BACKEND", "networkx")
+    vault_key = os.path.normpath(os.path.abspath(vault_path))
+    index_path = get_graph_index_path(vault_path, backend)
+
+    with _vault_graphs_lock:
+        vault_graph = _vault_graphs.get((vault_key, backend))
+        if vault_graph is None:
+            vault_graph = VaultGraph.load(index_path, vault_path, backend=backend)
+            _vault_graphs[(vault_key, backend)] = vault_graph
+
+        if vault_graph.refresh():
+            vault_graph.save(index_path)
+
+    return vault_graph
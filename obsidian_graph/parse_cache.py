@@ -0,0 +1,67 @@
+import pickle
+import zlib
+
+from utils.side_store import SQLiteStore, StoreRegistry
+
+
+class ParseCache(SQLiteStore):
+    """
+    On-disk cache of parse_markdown_file output keyed on (path, mtime, size).
+
+    Parsed notes are stored as zlib compressed pickles in SQLite, an entry is only
+    returned while the file's mtime and size are unchanged.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS parsed_notes (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, path="parse_cache.sqlite"):
+        super().__init__(path)
+
+    def get_many(self, path_to_stat):
+        """Return path -> parsed note for every path whose cached (mtime, size) still matches"""
+        found = {}
+        paths = list(path_to_stat.keys())
+        with self.lock:
+            for start in range(0, len(paths), 500):
+                batch = paths[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT path, mtime, size, data FROM parsed_notes WHERE path IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for path, mtime, size, data in rows:
+                    if (mtime, size) == path_to_stat[path]:
+                        found[path] = pickle.loads(zlib.decompress(data))
+        return found
+
+    def put_many(self, entries):
+        """entries: path -> ((mtime, size), parsed note)"""
+        rows = [
+            (path, stat[0], stat[1], zlib.compress(pickle.dumps(parsed, protocol=pickle.HIGHEST_PROTOCOL)))
+            for path, (stat, parsed) in entries.items()
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO parsed_notes (path, mtime, size, data) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+
+_parse_caches = StoreRegistry(ParseCache, "PARSE_CACHE_PATH", "parse_cache.sqlite")
+
+
+def get_parse_cache(path=None):
+    """
+    Return the process wide parse cache. Defaults to the PARSE_CACHE_PATH env var,
+    or parse_cache.sqlite inside CHROMA_DB_PATH.
+    """
+    return _parse_caches.get(path)
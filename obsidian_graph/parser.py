@@ -1,14 +1,144 @@
+import math
 import os
 import re
+import threading
+import multiprocessing
 import yaml
-from store_in_vectore_db import dissect_markdown_with_images
+from concurrent.futures import ProcessPoolExecutor
+from utils.image_blob_store import dissect_markdown_with_images
+from obsidian_graph.parse_cache import get_parse_cache
 
+## below this many uncached files parsing inline is faster than starting a process pool
+MIN_FILES_FOR_POOL = 64
+## every worker pays a process start and an import of the main module, so the pool gets
+## one worker per FILES_PER_WORKER uncached files and at most MAX_PARSE_WORKERS (PARSE_WORKERS env var)
+FILES_PER_WORKER = 64
+MAX_PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", 8))
+
+_parse_pool = None
+_parse_pool_workers = 0
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool(workers):
+    """
+    Process pool for parsing, kept for the life of the process.
+
+    Workers are spawned rather than forked (a fork would copy the app's ChromaDB, CUDA
+    and Gradio state). Spawned workers re-import the main module, which is kept cheap
+    (app.py builds no handlers or UI at import), and the pool is reused across graph
+    initializations so that start up is paid once.
+    """
+    global _parse_pool, _parse_pool_workers
+    with _parse_pool_lock:
+        ## a larger pool is reused as is, its workers are already started or start on demand
+        if _parse_pool is None or _parse_pool_workers < workers:
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=False)
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _parse_pool_workers = workers
+        return _parse_pool
+
+
+def normalize_link_target(link):
+    """
+    Reduce a wikilink like 'Folder/Note.md#Section|Alias' to the normalized target 'folder/note'.
+    Obsidian resolves links case-insensitively and ignores the section, block and display parts.
+    """
+    target = link.split("|")[0].split("#")[0].split("^")[0].strip()
+    target = target.replace("\\", "/").strip("/")
+    if target.lower().endswith(".md"):
+        target = target[:-3]
+    return target.lower()
+
+
+def get_note_aliases(metadata):
+    """aliases declared in the frontmatter as `aliases` or `alias`, either a string or a list"""
+    if not isinstance(metadata, dict):
+        return []
+
+    aliases = []
+    for field in ("aliases", "alias"):
+        value = metadata.get(field)
+        if isinstance(value, str):
+            aliases.append(value)
+        elif isinstance(value, list):
+            aliases.extend(str(i) for i in value if i is not None)
+    return aliases
+
+
+class WikilinkIndex:
+    """
+    Dict based index resolving wikilinks to note keys in O(1).
+
+    Follows Obsidian's rules: an exact vault relative path wins, then a path relative to the
+    linking note, then the shortest unique path suffix (e.g. [[Folder/Note]]), then the note name
+    (preferring the linking note's folder, then the note closest to the vault root) and finally aliases.
+    """
+
+    def __init__(self, note_keys, notes=None):
+        self.path_index = {}  ## normalized relative path -> key
+        self.suffix_index = {}  ## normalized path suffix with a folder -> keys
+        self.name_index = {}  ## normalized note name -> keys
+        self.alias_index = {}  ## normalized alias -> keys
+
+        for note_key in note_keys:
+            normalized = note_key.replace(os.sep, "/").lower()
+            self.path_index[normalized] = note_key
+
+            parts = normalized.split("/")
+            self.name_index.setdefault(parts[-1], []).append(note_key)
+            for i in range(1, len(parts) - 1):
+                self.suffix_index.setdefault("/".join(parts[i:]), []).append(note_key)
+
+            if notes is not None and note_key in notes:
+                for alias in get_note_aliases(notes[note_key].get("metadata")):
+                    self.alias_index.setdefault(alias.strip().lower(), []).append(note_key)
+
+    @staticmethod
+    def _pick(candidates, source_key=None):
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if source_key is not None:
+            source_dir = os.path.dirname(source_key)
+            same_dir = [key for key in candidates if os.path.dirname(key) == source_dir]
+            if same_dir:
+                candidates = same_dir
+
+        return min(candidates, key=lambda key: (key.count(os.sep), len(key), key))
+
+    def resolve(self, link, source_key=None):
+        """Return the note key a wikilink points to, or None for a dangling link"""
+        target = normalize_link_target(link)
+        if not target:
+            ## [[#Section]] links to the note itself
+            return source_key
+
+        if target in self.path_index:
+            return self.path_index[target]
+
+        if source_key is not None:
+            source_dir = os.path.dirname(source_key).replace(os.sep, "/").lower()
+            if source_dir:
+                relative = os.path.normpath(f"{source_dir}/{target}").replace(os.sep, "/")
+                if relative in self.path_index:
+                    return self.path_index[relative]
+
+        if "/" in target:
+            candidates = self.suffix_index.get(target)
+        else:
+            candidates = self.name_index.get(target)
+        if candidates:
+            return self._pick(candidates, source_key)
+
+        candidates = self.alias_index.get(link.split("|")[0].split("#")[0].strip().lower())
+        if candidates:
+            return self._pick(candidates, source_key)
 
-def extract_matching_substring(path, X):
-    matches = [s for s in X if s in path]
-    if not matches:
         return None
-    return max(matches, key=len)
 
 
 def parse_markdown_file(file_path):
@@ -29,7 +159,8 @@ def parse_markdown_file(file_path):
     # Extract tags
     tags = re.findall(r"#(\w+)", content)
 
-    content, reference_images = dissect_markdown_with_images(content)
+    ## the graph never resolves the references, so images are only stripped
+    content, reference_images = dissect_markdown_with_images(content, persist=False)
 
     return {
         "metadata": metadata,
@@ -40,43 +171,102 @@ def parse_markdown_file(file_path):
     }
 
 
-def parse_vault(vault_path):
-    notes = {}
-    all_note_keys = []
-    title_to_path = {}
+def parse_markdown_files(file_paths, workers=None, use_cache=True):
+    """
+    Parse many markdown files, returns file path -> parsed note.
+
+    Files whose (path, mtime, size) is in the parse cache are not read again, the rest
+    are parsed across a process pool of up to `workers` processes (all cores by default),
+    capped by MAX_PARSE_WORKERS and by the number of files to parse.
+    """
+    file_paths = list(file_paths)
+    path_to_key = {path: os.path.normpath(os.path.abspath(path)) for path in file_paths}
+    key_to_stat = {}
+    for path, key in path_to_key.items():
+        stat = os.stat(path)
+        key_to_stat[key] = (stat.st_mtime, stat.st_size)
+
+    cache = get_parse_cache() if use_cache else None
+    cached = cache.get_many(key_to_stat) if cache is not None else {}
+
+    to_parse = [path for path in file_paths if path_to_key[path] not in cached]
+    workers = min(
+        workers or os.cpu_count() or 1,
+        MAX_PARSE_WORKERS,
+        math.ceil(len(to_parse) / FILES_PER_WORKER),
+    )
+
+    if workers > 1 and len(to_parse) >= MIN_FILES_FOR_POOL:
+        chunksize = max(1, len(to_parse) // (workers * 4))
+        executor = _get_parse_pool(workers)
+        parsed_notes = list(executor.map(parse_markdown_file, to_parse, chunksize=chunksize))
+    else:
+        parsed_notes = [parse_markdown_file(path) for path in to_parse]
+
+    print(f"Parsed {len(to_parse)} notes, {len(file_paths) - len(to_parse)} served from the parse cache.")
+
+    if cache is not None and to_parse:
+        cache.put_many(
+            {
+                path_to_key[path]: (key_to_stat[path_to_key[path]], parsed)
+                for path, parsed in zip(to_parse, parsed_notes)
+            }
+        )
+
+    results = dict(zip(to_parse, parsed_notes))
+    for path in file_paths:
+        if path not in results:
+            results[path] = cached[path_to_key[path]]
+    return results
 
-    # First pass: index note paths
-    for root, _, files in os.walk(vault_path):
-        for file in files:
-            if file.endswith(".md"):
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, vault_path)
-                title = os.path.splitext(os.path.basename(file))[0]
-                title_to_path[title] = os.path.normpath(full_path)
-                note_key = os.path.splitext(os.path.relpath(full_path, vault_path))[0]
-                all_note_keys.append(note_key)
 
-    # Second pass: parse and resolve wikilinks
+def index_vault(vault_path):
+    """
+    First pass over the vault: index note paths.
+
+    Returns:
+        dict: note key (path relative to the vault without .md) -> full path of every note
+    """
+    note_paths = {}
+
     for root, _, files in os.walk(vault_path):
         for file in files:
             if file.endswith(".md"):
                 full_path = os.path.join(root, file)
                 note_key = os.path.splitext(os.path.relpath(full_path, vault_path))[0]
-                parsed = parse_markdown_file(full_path)
-
-                resolved_links = dict() ##full path
-                matching_link = dict()  ## path that is the key in notes
-                for link in parsed["wikilinks"]:
-                    link_title = link.split("|")[
-                        0
-                    ]  # Handle display text like [[Note Title|Display]]
-                    resolved_path = title_to_path.get(link_title)
-                    resolved_links[link]= resolved_path
-                    matching_link[link] = extract_matching_substring(resolved_path,all_note_keys)
-
-                parsed["wikilinks_fulllpath"] = resolved_links
-                parsed["corrected_wikilinks"]=matching_link
-                notes[note_key] = parsed
+                note_paths[note_key] = full_path
+
+    return note_paths
+
+
+def resolve_wikilinks(parsed, link_index, note_paths, source_key=None):
+    """Resolve the wikilinks of a parsed note to full paths and to keys of the notes dict"""
+    resolved_links = dict() ##full path
+    matching_link = dict()  ## path that is the key in notes
+    for link in parsed["wikilinks"]:
+        note_key = link_index.resolve(link, source_key=source_key)
+        resolved_links[link] = os.path.normpath(note_paths[note_key]) if note_key else None
+        matching_link[link] = note_key
+
+    parsed["wikilinks_fulllpath"] = resolved_links
+    parsed["corrected_wikilinks"]=matching_link
+    return parsed
+
+
+def parse_vault(vault_path, workers=None, use_cache=True):
+    notes = {}
+
+    # First pass: index note paths
+    note_paths = index_vault(vault_path)
+
+    # Second pass: parse notes, in parallel and skipping unchanged cached notes
+    parsed_notes = parse_markdown_files(note_paths.values(), workers=workers, use_cache=use_cache)
+    for note_key, full_path in note_paths.items():
+        notes[note_key] = parsed_notes[full_path]
 
+    # Resolve wikilinks with the title/path/alias index
+    link_index = WikilinkIndex(note_paths.keys(), notes)
+    for note_key, parsed in notes.items():
+        resolve_wikilinks(parsed, link_index, note_paths, source_key=note_key)
 
     return notes
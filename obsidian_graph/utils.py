@@ -1,8 +1,14 @@
 from collections import deque
 
+import networkx as nx
+
 
 def bfs_upto_levels(graph, start_node, max_levels):
     ## BFS search for context
+    if hasattr(graph, "bfs_upto_levels"):
+        ## CSRGraph expands whole frontiers with NumPy
+        return graph.bfs_upto_levels(start_node, max_levels)
+
     visited = set()
     queue = deque([(start_node, 0)])  # (node, current_level)
     result = []
@@ -21,3 +27,10 @@ def bfs_upto_levels(graph, start_node, max_levels):
                     queue.append((neighbor, level + 1))
 
     return result
+
+
+def shortest_path(graph, source, target):
+    ## works for networkx graphs and CSRGraph (bidirectional BFS)
+    if hasattr(graph, "shortest_path"):
+        return graph.shortest_path(source, target)
+    return nx.shortest_path(graph, source=source, target=target)
@@ -1,63 +1,29 @@
-import time
-from pathlib import Path
-
 import os
 import pandas as pd
 
 from langchain_text_splitters import MarkdownHeaderTextSplitter
-import re
+from collections import Counter
 
 from utils.basic_utils import generate_unique_id
 from utils.cleaning_utils import is_header_to_skip
-from utils.chromaDB_Handler import ChromaDBHandler
+from utils.chromaDB_Handler import get_chroma_handler
+from utils.image_blob_store import dissect_markdown_with_images
+from utils.filename_index import get_filename_index
 
 CHROMA_DB_PATH = os.environ['CHROMA_DB_PATH']
-# Initialize the database handler with the custom embedding function
-vdb_handler = ChromaDBHandler(path=CHROMA_DB_PATH)
+# Shared database handler, its client and embedding model are loaded on first use
+vdb_handler = get_chroma_handler(CHROMA_DB_PATH)
 vdb_collection_name = os.environ['markdown_chunk_collection_vdb'] ## this is where we save the MD chunks from the PDF
 
 
-from docling_core.types.doc import ImageRefMode, PictureItem, TableItem
-from docling.datamodel.base_models import FigureElement, InputFormat, Table
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.document_converter import DocumentConverter, PdfFormatOption
-
-IMAGE_RESOLUTION_SCALE = 2.0
-
-pipeline_options = PdfPipelineOptions()
-pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
-pipeline_options.generate_page_images = True
-pipeline_options.generate_picture_images = True
-
-def dissect_markdown_with_images(markdown_text):
-    """
-    Dissects a markdown text with embedded images, replacing them with unique strings
-    and extracting the image embeddings into a dictionary.
-
-    Args:
-        markdown_text (str): The markdown text containing image embeddings.
-
-    Returns:
-        tuple: Updated markdown text with references and a dictionary mapping references to embeddings.
-    """
-    image_pattern = r'!\[Image\]\((.*?)\)'  # Pattern to specifically match ![Image](data...)
-    references = {}
-    
-    def replace_with_reference(match):
-        image_data = match.group(0)  # Full matched string
-        ref_key = f"<reference image {generate_unique_id()}>"
-        references[ref_key] = image_data
-        return ref_key
-
-    updated_markdown = re.sub(image_pattern, replace_with_reference, markdown_text)
-    return updated_markdown, references
+from utils.doc_converter import convert_doc_to_markdown
 
 
 def add_info_to_metadata(md_header_splits, filename='', vault_name=''):
     vault_dir = os.path.basename(vault_name)
 
     for doc in md_header_splits:
-        ###add_image_embeddings_to_metadata
+        ###add_image_hashes_to_metadata, the images themselves live in the blob store
         if '![Image]' in doc.page_content:
             updated_text, image_dict = dissect_markdown_with_images(doc.page_content)
             doc.page_content = updated_text
@@ -148,34 +114,6 @@ def markdown_to_chunks(md_content, filename,vault_name,filter_on_headers=False):
 
     return md_header_splits
 
-def convert_doc_to_markdown(source):
-    '''read PDF and convert to MD with embedded images'''
-
-    input_doc_path = Path(source)
-    # output_dir = Path(save_root)
-
-    doc_converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-        }
-    )
-
-    start_time = time.time()
-
-    conv_res = doc_converter.convert(input_doc_path)
-
-    # output_dir.mkdir(parents=True, exist_ok=True)
-    # doc_filename = conv_res.input.file.stem
-
-    end_time = time.time()
-
-    md_dump = conv_res.document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
-
-    print(f'TIME TAKEN to convert doc to MD: {end_time - start_time}')
-
-    return md_dump
-
-
 def add_chunks_to_DB(md_header_splits):
     '''add to vector DB'''
 
@@ -193,25 +131,40 @@ def add_chunks_to_DB(md_header_splits):
             else:
                 metadata_to_save.append({'1':1})
         
+        ## embed once here, the vectors are handed on to retrieval in generate_notes
+        embeddings_to_save = vdb_handler.embed(documents_to_save) if documents_to_save else []
+
         vdb_handler.add_to_collection(
             vdb_collection_name,
             ids=ids_to_save,
             documents=documents_to_save,
-            metadatas=metadata_to_save
+            metadatas=metadata_to_save,
+            embeddings=embeddings_to_save
+        )
+
+        ## keep the list of stored files current without scanning the collection
+        get_filename_index().add(
+            vdb_collection_name,
+            Counter(meta['filename'] for meta in metadata_to_save if meta.get('filename')),
         )
 
         print(f'Successfully added chunks to the vector DB')
-        return documents_to_save
+        return documents_to_save, embeddings_to_save
     except Exception as e:
         print(f'ERROR while adding chunks to Vector DB:\n{e}')
-        return []
+        return [], []
 
-def store_doc_to_vector_db(source,vault_name,filter_on_headers=False):
-    '''store the given document to a vector DB'''
+def store_doc_to_vector_db(source,vault_name,filter_on_headers=False,md_content=None,return_embeddings=False):
+    '''
+    store the given document to a vector DB, md_content can be passed if the doc was already converted(e.g. by a conversion worker).
+    With return_embeddings the chunk embeddings are returned as well: (chunks, embeddings)
+    '''
     filename = os.path.basename(source)
     print(f'Processing {filename} in store_doc_to_vector_db')
 
-    if filename[-3:]!='.md':
+    if md_content is not None:
+        print("=========Using pre-converted Markdown=======")
+    elif filename[-3:]!='.md':
         print("=========Converting to Markdown=======")
         ## convert doc to markdown string
         md_content = convert_doc_to_markdown(source)
@@ -228,7 +181,10 @@ def store_doc_to_vector_db(source,vault_name,filter_on_headers=False):
 
     print("=========Saving to VDB==============")
     ## add chunks to vector DB
-    chunks_content = add_chunks_to_DB(md_header_splits)
+    chunks_content, chunks_embeddings = add_chunks_to_DB(md_header_splits)
+
+    if return_embeddings:
+        return chunks_content, chunks_embeddings
 
     return chunks_content
 
@@ -0,0 +1,131 @@
+import json
+import time
+from typing import Dict, Optional
+
+from utils.basic_utils import generate_unique_hash
+from utils.side_store import SQLiteStore, StoreRegistry, default_store_path
+
+
+class LLMResponseCache(SQLiteStore):
+    """
+    Persistent content-addressed cache of LLM responses stored in SQLite.
+
+    Entries are keyed on the hash of (provider, model, system_prompt, user_prompt)
+    and evicted by age and by total size (least recently used first).
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses (accessed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_created_at ON responses (created_at)",
+    )
+
+    def __init__(
+        self,
+        path: str = "llm_cache.sqlite",
+        max_bytes: int = 512 * 1024 * 1024,
+        max_age_seconds: Optional[float] = 30 * 24 * 3600,
+    ):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        ## running size of all entries, so eviction doesn't sum the table on every put
+        with self.lock:
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model_name: str, system_prompt: str, user_prompt: str) -> str:
+        """Hash of the full request"""
+        return generate_unique_hash(json.dumps([provider, model_name, system_prompt, user_prompt]))
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.stats["misses"] += 1
+                return None
+
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.stats["writes"] += 1
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        if self.max_age_seconds is not None:
+            cutoff = now - self.max_age_seconds
+            expired_bytes = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses WHERE created_at < ?", (cutoff,)
+            ).fetchone()[0]
+            cursor = self.conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+            self.stats["evictions"] += cursor.rowcount
+            self.total_bytes -= expired_bytes
+
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+
+        to_delete = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            if self.total_bytes <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            self.total_bytes -= size
+
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+        self.stats["evictions"] += len(to_delete)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {**self.stats, "entries": entries, "bytes": size}
+
+
+_caches: StoreRegistry[LLMResponseCache] = StoreRegistry(LLMResponseCache, "LLM_CACHE_PATH", "llm_cache.sqlite")
+
+
+def get_llm_cache(path: Optional[str] = None) -> Optional[LLMResponseCache]:
+    """
+    Return the process wide cache for a path. Defaults to the LLM_CACHE_PATH env var,
+    or llm_cache.sqlite inside CHROMA_DB_PATH. Setting it to an empty string disables caching.
+    """
+    if path is None:
+        path = default_store_path("LLM_CACHE_PATH", "llm_cache.sqlite")
+    if not path:
+        return None
+
+    return _caches.get(path)
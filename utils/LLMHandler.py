@@ -1,9 +1,270 @@
 from abc import ABC, abstractmethod
+import asyncio
 import os
+import random
+import threading
+import time
+import weakref
 import google.generativeai as genai
-from huggingface_hub import InferenceClient
+from huggingface_hub import InferenceClient, AsyncInferenceClient
+from huggingface_hub.utils import is_aiohttp_available
 import ollama
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Awaitable, Callable
+
+from utils.LLMCache import get_llm_cache
+
+# Per provider limits, None means unlimited. Override with <PROVIDER>_RPM / <PROVIDER>_TPM env vars.
+DEFAULT_RATE_LIMITS = {
+    "gemini": {"requests_per_minute": 15, "tokens_per_minute": 1_000_000},
+    "huggingface": {"requests_per_minute": 60, "tokens_per_minute": None},
+    "ollama": {"requests_per_minute": None, "tokens_per_minute": None},
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) used for rate limiting"""
+    return max(1, len(text) // 4)
+
+
+def _limit_from_env(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    value = int(value)
+    return value if value > 0 else None
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously up to its capacity"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def _take(self, amount: float) -> float:
+        """Take `amount` tokens if available and return 0, else return the seconds to wait"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.refill_per_second
+
+    def acquire(self, amount: float = 1) -> None:
+        """Block until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, amount: float = 1) -> None:
+        """Same as acquire, but waits on the event loop instead of blocking the thread"""
+        amount = min(amount, self.capacity)
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def consume(self, amount: float) -> None:
+        """Take tokens without blocking, the bucket may go into debt"""
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter with backoff on 429/quota errors"""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 60.0,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def acquire(self, n_tokens: int = 1) -> None:
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket:
+            self.token_bucket.acquire(n_tokens)
+
+    async def aacquire(self, n_tokens: int = 1) -> None:
+        if self.request_bucket:
+            await self.request_bucket.aacquire(1)
+        if self.token_bucket:
+            await self.token_bucket.aacquire(n_tokens)
+
+    def record(self, n_tokens: int) -> None:
+        """Account for tokens that were only known after the call, e.g. the completion"""
+        if self.token_bucket:
+            self.token_bucket.consume(n_tokens)
+
+    def call(self, fn, n_tokens: int = 1):
+        """Run fn under the limits, retrying rate limit errors with exponential backoff and jitter"""
+        attempt = 0
+        while True:
+            self.acquire(n_tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                attempt += 1
+                print(f"Rate limited ({e}). Retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+                time.sleep(delay)
+
+    async def acall(self, fn: Callable[[], Awaitable], n_tokens: int = 1):
+        """Async counterpart of call, fn returns a new awaitable on every attempt"""
+        attempt = 0
+        while True:
+            await self.aacquire(n_tokens)
+            try:
+                return await fn()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                attempt += 1
+                print(f"Rate limited ({e}). Retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Detect 429 / quota errors raised by any of the provider clients"""
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if status == 429:
+            return True
+
+    message = str(error).lower()
+    return any(
+        marker in message
+        for marker in ("429", "rate limit", "ratelimit", "quota", "resource exhausted", "resource_exhausted", "too many requests")
+    )
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """Return the limiter shared by every handler of a provider"""
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            limits = DEFAULT_RATE_LIMITS.get(provider, {})
+            prefix = provider.upper()
+            _rate_limiters[provider] = RateLimiter(
+                requests_per_minute=_limit_from_env(f"{prefix}_RPM", limits.get("requests_per_minute")),
+                tokens_per_minute=_limit_from_env(f"{prefix}_TPM", limits.get("tokens_per_minute")),
+            )
+        return _rate_limiters[provider]
+
+
+def configure_rate_limit(
+    provider: str,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    **kwargs,
+) -> RateLimiter:
+    """Replace the limiter of a provider, e.g. when the account has a higher quota"""
+    with _rate_limiters_lock:
+        _rate_limiters[provider] = RateLimiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            **kwargs,
+        )
+        return _rate_limiters[provider]
+
+
+class UsageTracker:
+    """Thread-safe running totals of prompt and completion tokens per (provider, model)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals: Dict[tuple, Dict[str, int]] = {}
+
+    def record(self, provider: str, model_name: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+        with self.lock:
+            totals = self.totals.setdefault(
+                (provider, model_name), {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens or 0
+            totals["completion_tokens"] += completion_tokens or 0
+
+    def get_stats(self) -> Dict[tuple, Dict[str, int]]:
+        with self.lock:
+            return {key: dict(value) for key, value in self.totals.items()}
+
+
+_usage_tracker = UsageTracker()
+
+
+def get_usage_tracker() -> UsageTracker:
+    return _usage_tracker
+
+
+def _usage_field(usage: Any, *names: str) -> Optional[int]:
+    for name in names:
+        value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+        if value is not None:
+            return value
+    return None
+
+
+def record_usage(provider: str, model_name: str, usage: Any) -> None:
+    """
+    Report the token usage of one call from the provider's usage object
+    (Gemini usage_metadata, HuggingFace completion.usage or the Ollama response).
+    """
+    if usage is None:
+        return
+    try:
+        prompt_tokens = _usage_field(usage, "prompt_token_count", "prompt_tokens", "prompt_eval_count")
+        completion_tokens = _usage_field(usage, "candidates_token_count", "completion_tokens", "eval_count")
+    except Exception:
+        return
+
+    _usage_tracker.record(provider, model_name, prompt_tokens, completion_tokens)
+    print(f"LLM usage {provider}/{model_name}: prompt_tokens={prompt_tokens}, completion_tokens={completion_tokens}")
+
+
+_gemini_configured_key: Optional[str] = None
+_gemini_configure_lock = threading.Lock()
+
+
+def _configure_gemini(api_key: str) -> None:
+    """genai.configure is process wide, only redo it when the key changes"""
+    global _gemini_configured_key
+    with _gemini_configure_lock:
+        if _gemini_configured_key != api_key:
+            genai.configure(api_key=api_key)
+            _gemini_configured_key = api_key
+
 
 class BaseLLMHandler(ABC):
     """Abstract base class for LLM handlers"""
@@ -13,6 +274,25 @@ class BaseLLMHandler(ABC):
         """Generate response from the LLM"""
         pass
 
+    def generate_stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        """Yield the response in pieces as they arrive. Falls back to a single piece."""
+        yield self.generate(system_prompt, user_prompt)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+        """Generate without blocking the event loop. Falls back to generate on a worker thread."""
+        return await asyncio.to_thread(self.generate, system_prompt, user_prompt)
+
+    def _loop_client(self, factory: Callable[[], Any]) -> Any:
+        """Async clients are bound to the event loop they were first used on, keep one per loop"""
+        if not hasattr(self, "_async_clients"):
+            self._async_clients = weakref.WeakKeyDictionary()
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = factory()
+            self._async_clients[loop] = client
+        return client
+
 class GeminiHandler(BaseLLMHandler):
     """Handler for Google's Gemini LLM"""
     
@@ -21,13 +301,29 @@ class GeminiHandler(BaseLLMHandler):
         if not self.token:
             raise ValueError("GEMINI_KEY environment variable not set")
             
-        genai.configure(api_key=self.token)
+        _configure_gemini(self.token)
+        self.model_name = model_name
         self.model = genai.GenerativeModel(model_name)
     
     def generate(self, system_prompt: str, user_prompt: str) -> str:
         prompt = f'TASK: {system_prompt}\n\nUSER INPUT: {user_prompt}'
         response = self.model.generate_content(prompt)
-        print(response.usage_metadata)
+        record_usage("gemini", self.model_name, response.usage_metadata)
+        return response.text
+
+    def generate_stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        prompt = f'TASK: {system_prompt}\n\nUSER INPUT: {user_prompt}'
+        response = self.model.generate_content(prompt, stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+        record_usage("gemini", self.model_name, response.usage_metadata)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+        prompt = f'TASK: {system_prompt}\n\nUSER INPUT: {user_prompt}'
+        model = self._loop_client(lambda: genai.GenerativeModel(self.model_name))
+        response = await model.generate_content_async(prompt)
+        record_usage("gemini", self.model_name, response.usage_metadata)
         return response.text
 
 class HuggingFaceHandler(BaseLLMHandler):
@@ -56,6 +352,61 @@ class HuggingFaceHandler(BaseLLMHandler):
             max_tokens=2000
         )
 
+        record_usage("huggingface", self.model_name, completion.usage)
+        return completion.choices[0].message.content
+
+    def generate_stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+        ## the usage comes with the last chunk when requested, estimated if the endpoint doesn't send it
+        stream = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=2000,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        usage = None
+        completion_text = []
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                completion_text.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+        if usage is None:
+            usage = {
+                "prompt_tokens": estimate_tokens(system_prompt + user_prompt),
+                "completion_tokens": estimate_tokens("".join(completion_text)),
+            }
+        record_usage("huggingface", self.model_name, usage)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+        ## AsyncInferenceClient only imports aiohttp when a request is sent, check for it up front
+        ## and fall back to the sync client on a worker thread when it is missing
+        if not is_aiohttp_available():
+            return await super().agenerate(system_prompt, user_prompt)
+
+        client = self._loop_client(
+            lambda: AsyncInferenceClient(api_key=self.token, headers={"X-use-cache": "false"})
+        )
+        completion = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=2000
+        )
+
+        record_usage("huggingface", self.model_name, completion.usage)
         return completion.choices[0].message.content
 
 
@@ -64,44 +415,225 @@ class OllamaHandler(BaseLLMHandler):
 
     def __init__(self, model_name: str = "gemma3:1b"):
         self.model_name = model_name
-        all_ollama_models = [i.model for i in ollama.list().models]
+        ## one client per handler keeps its HTTP connection to the Ollama server alive
+        self.client = ollama.Client()
+        all_ollama_models = [i.model for i in self.client.list().models]
 
         self.pull = False
         if model_name not in all_ollama_models:
             self.pull = True
+        self.pull_lock = threading.Lock()
+
+    def _ensure_pulled(self) -> None:
+        with self.pull_lock:
+            if self.pull:
+                self.client.pull(self.model_name)
+                self.pull = False
 
     def generate(self, system_prompt: str, user_prompt: str) -> str:
 
+        self._ensure_pulled()
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        response = self.client.chat(model=self.model_name, messages=messages)
+        record_usage("ollama", self.model_name, response)
+        return response["message"]["content"]
+
+    def generate_stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+
+        self._ensure_pulled()
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        for part in self.client.chat(model=self.model_name, messages=messages, stream=True):
+            if part["message"]["content"]:
+                yield part["message"]["content"]
+            if part.get("done"):
+                record_usage("ollama", self.model_name, part)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+
+        ## pulling is a one off, do it on a worker thread with the sync client
         if self.pull:
-            ollama.pull(self.model_name)
-            self.pull = False
+            await asyncio.to_thread(self._ensure_pulled)
 
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
-        response = ollama.chat(model=self.model_name, messages=messages)
+        client = self._loop_client(ollama.AsyncClient)
+        response = await client.chat(model=self.model_name, messages=messages)
+        record_usage("ollama", self.model_name, response)
         return response["message"]["content"]
 
 
+PROVIDERS = {
+    "gemini": lambda m: GeminiHandler(model_name=m if m else "gemini-1.5-flash"),
+    "huggingface": lambda m: HuggingFaceHandler(model_name=m if m else "Qwen/Qwen2.5-72B-Instruct"),
+    "ollama": lambda m: OllamaHandler(model_name=m if m else "gemma3:1b")
+}
+
+_handler_pool: Dict[tuple, BaseLLMHandler] = {}
+_handler_pool_lock = threading.Lock()
+_handler_init_locks: Dict[tuple, threading.Lock] = {}
+
+
+def get_provider_handler(provider: str, model_name: Optional[str] = None) -> BaseLLMHandler:
+    """
+    Return the shared provider handler for (provider, model_name), creating it on first use.
+
+    Handlers hold the configured client and its keep-alive connections, so reusing them
+    skips genai.configure, new HTTP clients and the ollama.list() round trip per call.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unsupported provider: {provider}. Available providers: {list(PROVIDERS.keys())}")
+
+    key = (provider, model_name or None)
+    with _handler_pool_lock:
+        handler = _handler_pool.get(key)
+        if handler is not None:
+            return handler
+        init_lock = _handler_init_locks.setdefault(key, threading.Lock())
+
+    ## build outside the pool lock so a slow constructor only blocks callers of the same key
+    with init_lock:
+        with _handler_pool_lock:
+            handler = _handler_pool.get(key)
+        if handler is None:
+            handler = PROVIDERS[provider](model_name)
+            with _handler_pool_lock:
+                _handler_pool[key] = handler
+    return handler
+
+
+def clear_handler_pool(provider: Optional[str] = None) -> None:
+    """Drop pooled handlers (of one provider), e.g. after an API key change"""
+    with _handler_pool_lock:
+        for key in list(_handler_pool.keys()):
+            if provider is None or key[0] == provider:
+                del _handler_pool[key]
+
+
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+
+def run_async(coro):
+    """
+    Run a coroutine to completion on a long lived background event loop and return its result.
+
+    Sync callers (Gradio workers, scripts) go through one loop, so async clients bound to
+    it stay warm across calls instead of being rebuilt for every asyncio.run.
+    """
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None or _background_loop.is_closed():
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="llm-async-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop).result()
+
+
 class LLMHandler:
     """Main handler class that manages different LLM providers"""
     
-    def __init__(self, provider: str = "gemini", model_name: Optional[str] = None):
-        self.providers = {
-            "gemini": lambda m: GeminiHandler(model_name=m if m else "gemini-1.5-flash"),
-            "huggingface": lambda m: HuggingFaceHandler(model_name=m if m else "Qwen/Qwen2.5-72B-Instruct"),
-            "ollama": lambda m: OllamaHandler(model_name=m if m else "gemma3:1b")
-        }
-        
-        if provider not in self.providers:
-            raise ValueError(f"Unsupported provider: {provider}. Available providers: {list(self.providers.keys())}")
-        
-        self.handler = self.providers[provider](model_name)
+    def __init__(self, provider: str = "gemini", model_name: Optional[str] = None, use_cache: bool = True):
+        self.providers = PROVIDERS
+        self.provider = provider
+        self.handler = get_provider_handler(provider, model_name)
+        self.rate_limiter = get_rate_limiter(provider)
+        self.cache = get_llm_cache() if use_cache else None
     
-    def generate(self, system_prompt: str, user_prompt: str) -> str:
-        """Generate response using the configured LLM provider"""
-        return self.handler.generate(system_prompt, user_prompt)
+    def generate(self, system_prompt: str, user_prompt: str, bypass_cache: bool = False) -> str:
+        """
+        Generate response using the configured LLM provider.
+
+        Responses are served from the on-disk cache for identical requests unless
+        bypass_cache is set, in which case the fresh response replaces the cached one.
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.provider, self.handler.model_name, system_prompt, user_prompt)
+            if not bypass_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+        response = self.rate_limiter.call(
+            lambda: self.handler.generate(system_prompt, user_prompt),
+            n_tokens=estimate_tokens(system_prompt + user_prompt),
+        )
+        self.rate_limiter.record(estimate_tokens(response or ""))
+
+        if cache_key is not None and response:
+            self.cache.put(cache_key, response)
+
+        return response
+
+    async def agenerate(self, system_prompt: str, user_prompt: str, bypass_cache: bool = False) -> str:
+        """Async counterpart of generate with the same caching and rate limiting"""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.provider, self.handler.model_name, system_prompt, user_prompt)
+            if not bypass_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+        response = await self.rate_limiter.acall(
+            lambda: self.handler.agenerate(system_prompt, user_prompt),
+            n_tokens=estimate_tokens(system_prompt + user_prompt),
+        )
+        self.rate_limiter.record(estimate_tokens(response or ""))
+
+        if cache_key is not None and response:
+            self.cache.put(cache_key, response)
+
+        return response
+
+    def generate_stream(self, system_prompt: str, user_prompt: str, bypass_cache: bool = False) -> Iterator[str]:
+        """
+        Stream the response using the configured LLM provider, yielding text pieces as they arrive.
+
+        A cached response is yielded in one piece. Rate limit errors raised before the
+        first piece are retried with backoff, the full response is cached afterwards.
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.provider, self.handler.model_name, system_prompt, user_prompt)
+            if not bypass_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    yield cached
+                    return
+
+        def start_stream():
+            ## pull the first piece inside the limiter so 429s on connect are retried
+            stream = self.handler.generate_stream(system_prompt, user_prompt)
+            return stream, next(stream, None)
+
+        stream, first_piece = self.rate_limiter.call(
+            start_stream,
+            n_tokens=estimate_tokens(system_prompt + user_prompt),
+        )
+
+        pieces = []
+        if first_piece is not None:
+            pieces.append(first_piece)
+            yield first_piece
+        for piece in stream:
+            pieces.append(piece)
+            yield piece
+
+        response = "".join(pieces)
+        self.rate_limiter.record(estimate_tokens(response))
+
+        if cache_key is not None and response:
+            self.cache.put(cache_key, response)
     
     # @classmethod
     # def register_provider(cls, name: str, handler_class: type) -> None:
@@ -99,7 +99,7 @@ def merge_dicts(list_of_dicts):
 
     return dict(merged_dict)
 
-def replace_references(text: str, reference_dict: dict) -> str:
+def replace_references(text: str, reference_dict: dict, resolver=None) -> str:
     """
     Replace references in the format <reference image xyz> with their corresponding values from a dictionary.
     The entire tag is used as the dictionary key.
@@ -107,6 +107,8 @@ def replace_references(text: str, reference_dict: dict) -> str:
     Args:
         text (str): Input text containing references
         reference_dict (dict): Dictionary mapping full reference tags to their values
+        resolver (callable, optional): Applied to a dictionary value to get the replacement,
+            e.g. to load an image from the blob store by its hash. Unresolved tags are kept.
         
     Returns:
         str: Text with all references replaced with their corresponding values
@@ -128,7 +130,14 @@ def replace_references(text: str, reference_dict: dict) -> str:
     def replace_match(match):
         print(match)
         # Use the entire match as the dictionary key
-        return reference_dict.get(match.group(0), match.group(0))
+        value = reference_dict.get(match.group(0))
+        if value is None:
+            return match.group(0)
+        if resolver is not None:
+            value = resolver(value)
+            if value is None:
+                return match.group(0)
+        return value
     
 
     # Pattern matches <reference image anything>
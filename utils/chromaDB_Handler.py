@@ -2,71 +2,230 @@ import chromadb
 from chromadb.utils import embedding_functions
 
 import logging
+import threading
+
+import numpy as np
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
 
 class ChromaDBHandler:
     def __init__(self, path="chroma_store", embedding_model="all-MiniLM-L6-v2"):
-        self.client = chromadb.PersistentClient(
-            path=path,
-            # settings=Settings(),
-            # tenant="default_tenant",
-            # database="default_database"
-        )
+        ## the client and the embedding model are created on first use, so importing a module
+        ## that holds a handler (e.g. in a spawned worker) doesn't open the store or load the model
+        self.path = path
+        self.embedding_model = embedding_model
+        self._client = None
+        self._embedding_function = None
+        self._init_lock = threading.Lock()
 
-        logging.info("Initializing embedding function.")
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=embedding_model
-        )
-        logging.info("Initialized embedding function.")
+        ## collection handles resolved once and reused by every operation
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+        self.collection_cache_stats = {"hits": 0, "misses": 0}
+
+    @property
+    def client(self):
+        with self._init_lock:
+            if self._client is None:
+                self._client = chromadb.PersistentClient(
+                    path=self.path,
+                    # settings=Settings(),
+                    # tenant="default_tenant",
+                    # database="default_database"
+                )
+            return self._client
+
+    @property
+    def embedding_function(self):
+        with self._init_lock:
+            if self._embedding_function is None:
+                logging.info("Initializing embedding function.")
+                self._embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                    model_name=self.embedding_model
+                )
+                logging.info("Initialized embedding function.")
+            return self._embedding_function
 
     def create_collection(self, collection_name):
-        """Creates or retrieves a collection with the specified embedding function."""
-        return self.client.get_or_create_collection(
-            name=collection_name,
-            embedding_function=self.embedding_function,
-            metadata={
-                "hnsw:space": "cosine",
-                "hnsw:search_ef": 100
-            }
-        )
+        """Creates or retrieves a collection with the specified embedding function.
 
-    def add_to_collection(self, collection_name, ids, documents, metadatas=None):
-        """Adds documents to the specified collection."""
+        The handle is cached so that repeated operations on the same collection
+        don't call get_or_create_collection every time.
+        """
+        with self._collections_lock:
+            collection = self._collections.get(collection_name)
+            if collection is not None:
+                self.collection_cache_stats["hits"] += 1
+                return collection
+
+            self.collection_cache_stats["misses"] += 1
+            collection = self.client.get_or_create_collection(
+                name=collection_name,
+                embedding_function=self.embedding_function,
+                metadata={
+                    "hnsw:space": "cosine",
+                    "hnsw:search_ef": 100
+                }
+            )
+            self._collections[collection_name] = collection
+            return collection
+
+    def invalidate_collection(self, collection_name=None):
+        """Drops the cached handle for a collection, or all handles if no name is given."""
+        with self._collections_lock:
+            if collection_name is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(collection_name, None)
+
+    def embed(self, texts):
+        """Embeds texts with the collection embedding function so the vectors can be reused."""
+        return self.embedding_function(texts)
+
+    def add_to_collection(self, collection_name, ids, documents, metadatas=None, embeddings=None):
+        """Adds documents to the specified collection. Precomputed embeddings skip the embedding function."""
         collection = self.create_collection(collection_name)
-        collection.add(ids=ids, documents=documents, metadatas=metadatas)
+        collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
 
-    def query_collection(self, collection_name, query_texts, n_results=5, 
+    def query_collection(self, collection_name, query_texts=None, n_results=5, 
                          include=["metadatas", "documents", "distances"], 
-                         where=None, max_distance=2.0
+                         where=None, max_distance=2.0, query_embeddings=None
                          ):
-        """Queries the specified collection."""
+        """Queries the specified collection by texts or by precomputed query_embeddings."""
+        if max_distance!=2.0:
+            return self.query_within_distance(
+                collection_name,
+                query_texts=query_texts,
+                k=n_results,
+                max_distance=max_distance,
+                include=include,
+                where=where,
+                query_embeddings=query_embeddings
+            )
+
         collection = self.create_collection(collection_name)
         results = collection.query(
-            query_texts=query_texts,
+            query_texts=query_texts if query_embeddings is None else None,
+            query_embeddings=query_embeddings,
             n_results=n_results,
             include=include,
             where=where
         )
 
-        if max_distance!=2.0:
-            results = self._filter_results_by_distance(results, max_distance=max_distance)
-
         return results
 
-    def get_in_collection(self, collection_name, n_results=None, include=["metadatas", "documents"], where=None):
+    def query_within_distance(self, collection_name, query_texts=None, k=5, max_distance=2.0,
+                              include=["metadatas", "documents", "distances"],
+                              where=None, query_embeddings=None
+                              ):
+        """
+        Distance-bounded search: up to k hits per query with a distance <= max_distance.
+
+        A single top-k query followed by the distance filter is exact. Results come sorted by
+        distance, so the hits within max_distance are a prefix of the top k, and any result past
+        the top k is at least as far as the k-th and can't add a hit.
+        """
+        ## distances are needed to filter, they are dropped again if the caller did not ask for them
+        fetch_include = list(include) if "distances" in include else list(include) + ["distances"]
+        collection = self.create_collection(collection_name)
+        results = collection.query(
+            query_texts=query_texts if query_embeddings is None else None,
+            query_embeddings=query_embeddings,
+            n_results=k,
+            include=fetch_include,
+            where=where
+        )
+
+        filtered = self._filter_results_by_distance(results, max_distance=max_distance, k=k)
+        if "distances" not in include:
+            filtered["distances"] = None
+        return filtered
+
+    def query_collection_batched(self, collection_name, query_texts=None, n_results=5,
+                                 include=["metadatas", "documents", "distances"],
+                                 where=None, max_distance=2.0, batch_size=64,
+                                 query_embeddings=None
+                                 ):
+        """
+        Queries the specified collection with many texts (or precomputed embeddings) in a few batched calls.
+
+        Returns:
+            list: One result dict per query, shaped like a single-query query_collection result.
+        """
+        n_queries = len(query_embeddings) if query_embeddings is not None else len(query_texts)
+        per_query_results = []
+        for start in range(0, n_queries, batch_size):
+            results = self.query_collection(
+                collection_name,
+                query_texts=query_texts[start:start + batch_size] if query_embeddings is None else None,
+                n_results=n_results,
+                include=include,
+                where=where,
+                max_distance=max_distance,
+                query_embeddings=query_embeddings[start:start + batch_size] if query_embeddings is not None else None
+            )
+            per_query_results.extend(self._split_results_by_query(results))
+
+        return per_query_results
+
+    def _split_results_by_query(self, results):
+        """Splits a multi-query result into single-query results."""
+        n_queries = len(results.get("ids") or [])
+        return [
+            {
+                field: [value[i]] if isinstance(value, list) and field != "included" else value
+                for field, value in results.items()
+            }
+            for i in range(n_queries)
+        ]
+
+    def get_in_collection(self, collection_name, n_results=None, include=["metadatas", "documents"], where=None, offset=None):
         """SELECT record from the specified collection """
         collection = self.create_collection(collection_name)
         results = collection.get(
             limit=n_results,
+            offset=offset,
             include=include,
             where=where
         )
         return results
 
+    def iter_collection(self, collection_name, include=["metadatas"], where=None, batch_size=1000, metadata_keys=None):
+        """
+        Paginated scan of a collection, yields one get result per batch of at most batch_size records.
+
+        Only the fields in include are fetched. metadata_keys further projects every metadata
+        dict to those keys, so large values (e.g. image hashes) are not kept around while scanning.
+        """
+        collection = self.create_collection(collection_name)
+        offset = 0
+        while True:
+            results = collection.get(
+                limit=batch_size,
+                offset=offset,
+                include=include,
+                where=where
+            )
+            n_records = len(results["ids"])
+            if n_records == 0:
+                return
+
+            if metadata_keys is not None and results.get("metadatas") is not None:
+                results["metadatas"] = [
+                    {key: meta[key] for key in metadata_keys if key in meta} if meta else meta
+                    for meta in results["metadatas"]
+                ]
+
+            yield results
+
+            if n_records < batch_size:
+                return
+            offset += n_records
+
     def delete_collection(self, collection_name):
         """Deletes the specified collection."""
+        self.invalidate_collection(collection_name)
         self.client.delete_collection(name=collection_name)
 
     def list_collections(self):
@@ -78,41 +237,114 @@ class ChromaDBHandler:
         collection = self.create_collection(collection_name)
         collection.delete(ids=ids)
 
-    def update_in_collection(self, collection_name, ids, documents=None, metadatas=None):
-        """Updates documents and/or metadata for the specified IDs in the collection."""
+    def delete_where(self, collection_name, where, batch_size=500, dry_run=False, keep=None, metadata_keys=None):
+        """
+        Deletes every record matching a metadata filter, batch_size records at a time.
+
+        keep is an optional metadata -> bool check for conditions a where filter can't express,
+        matching records it returns True for are left in place. metadata_keys projects the
+        metadata passed to keep. Only one batch is held in memory and ids are never logged.
+        With dry_run nothing is deleted and only the records to delete are counted.
+
+        Returns:
+            dict: {"matched": records to delete, "deleted": records deleted, "batches": delete calls}
+        """
+        collection = self.create_collection(collection_name)
+        include = ["metadatas"] if keep is not None else []
+        matched = 0
+        deleted = 0
+        batches = 0
+        offset = 0
+        while True:
+            results = collection.get(where=where, limit=batch_size, offset=offset, include=include)
+            ids = results["ids"]
+            if not ids:
+                break
+
+            if keep is None:
+                ids_to_del = ids
+            else:
+                ids_to_del = [
+                    id
+                    for id, meta in zip(ids, results["metadatas"])
+                    if not keep({key: (meta or {}).get(key) for key in metadata_keys} if metadata_keys else meta or {})
+                ]
+            matched += len(ids_to_del)
+
+            if ids_to_del and not dry_run:
+                collection.delete(ids=ids_to_del)
+                deleted += len(ids_to_del)
+                batches += 1
+                ## deleted records drop out of the filter, only the kept ones shift the next page
+                offset += len(ids) - len(ids_to_del)
+            else:
+                offset += len(ids)
+
+            if len(ids) < batch_size:
+                break
+
+        if dry_run:
+            logging.info(f"Dry run: {matched} records in {collection_name} would be deleted.")
+        else:
+            logging.info(f"Deleted {deleted} records from {collection_name} in {batches} batches.")
+        return {"matched": matched, "deleted": deleted, "batches": batches}
+
+    def update_in_collection(self, collection_name, ids, documents=None, metadatas=None, embeddings=None):
+        """Updates documents, metadata and/or embeddings for the specified IDs in the collection."""
         collection = self.create_collection(collection_name)
-        collection.update(ids=ids, documents=documents, metadatas=metadatas)
+        collection.update(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
 
-    def _filter_results_by_distance(self, results, max_distance=2.0):
+    def _filter_results_by_distance(self, results, max_distance=2.0, k=None):
         """
         Filters results based on a maximum cosine distance.
 
         Parameters:
             results (dict): Dictionary containing various fields as keys, with their values structured as lists.
             max_distance (float): Maximum allowed cosine distance.
+            k (int): Keep at most k entries per query.
 
         Returns:
             dict: Filtered results containing only entries with distances <= max_distance.
         """
-        # Get all keys from the results dictionary to dynamically determine query fields.
-        query_fields = results.keys()
+        # "included" lists the requested fields rather than per query values, so it is passed through.
+        query_fields = [field for field in results.keys() if field != "included"]
 
-        # Initialize the filtered result dictionary with an empty list for each query field.
-        distance_filtered_result = {field: [[]] if isinstance(results.get(field),list) else None for field in query_fields}
+        n_queries = len(results.get("ids") or [])
+        distance_filtered_result = {field: [] if results.get(field) is not None else None for field in query_fields}
+        if "included" in results:
+            distance_filtered_result["included"] = results["included"]
 
-        # Determine the length of the first valid field.
-        length_of_existing_fields = max((len(v[0]) for v in results.values() if v!=None and v[0]), default=0)
+        for query_idx in range(n_queries):
+            # Entries without distances can't be checked against the threshold and are dropped.
+            distances = results.get("distances")
+            if distances is None:
+                keep = np.empty(0, dtype=np.int64)
+            else:
+                keep = np.flatnonzero(np.asarray(distances[query_idx], dtype=np.float32) <= max_distance)[:k]
 
-        # Iterate over all entries by zipping together the corresponding values from each query field.
-        for entries in zip(*(results[field][0] if results.get(field)!=None else [None] * length_of_existing_fields for field in query_fields)):
-            # Create a dictionary mapping field names to their corresponding values for the current entry.
-            entry_dict = dict(zip(query_fields, entries))
-
-            # Check if the distance value exists and is within the allowed maximum distance.
-            if entry_dict.get('distances') is not None and entry_dict['distances'] <= max_distance:
-                # Append the corresponding values to the filtered result for each query field.
-                for field in query_fields:
-                    if distance_filtered_result[field]!=None:
-                        distance_filtered_result[field][0].append(entry_dict[field])
+            # Results come sorted by distance, so the kept entries are usually a prefix and can be sliced.
+            is_prefix = len(keep) == 0 or keep[-1] == len(keep) - 1
+            for field in query_fields:
+                if distance_filtered_result[field] is None:
+                    continue
+                values = results[field][query_idx]
+                if values is None:
+                    distance_filtered_result[field].append(None)
+                elif is_prefix:
+                    distance_filtered_result[field].append(list(values[:len(keep)]))
+                else:
+                    distance_filtered_result[field].append([values[i] for i in keep])
 
         return distance_filtered_result
+
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+def get_chroma_handler(path="chroma_store"):
+    """Return the process wide handler for a store, so every module shares one client and embedding model"""
+    with _handlers_lock:
+        if path not in _handlers:
+            _handlers[path] = ChromaDBHandler(path=path)
+        return _handlers[path]
@@ -0,0 +1,128 @@
+import os
+import re
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.basic_utils import generate_unique_hash
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _shingle_hashes(text: str, k: int = 3) -> np.ndarray:
+    """32 bit hashes of the word k-grams of text (whole text for very short chunks)"""
+    words = _TOKEN_RE.findall(text.lower())
+    if len(words) < k:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+class ChunkDeduplicator:
+    """
+    Tracks chunks already covered by a note, matching exact copies and near duplicates.
+
+    Exact matches go through a set of content hashes. Near duplicates are found with
+    MinHash signatures over word 3-grams and an LSH band index, a candidate counts as a
+    duplicate when its estimated Jaccard similarity is at least `similarity`.
+    `similarity` defaults to the DEDUP_SIMILARITY env var (0.8), 1 keeps exact matching only.
+    """
+
+    def __init__(self, similarity: Optional[float] = None, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if similarity is None:
+            similarity = float(os.environ.get("DEDUP_SIMILARITY", 0.8))
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+
+        self.similarity = similarity
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        self.hashes = set()
+        self.counts: Dict[str, int] = {}  ## times every text was added, remove() forgets it at 0
+        self.signatures: List[np.ndarray] = []
+        self.signature_ids: Dict[str, int] = {}
+        self.removed = set()  ## signature indices of removed texts, left out of the near duplicate search
+        self.buckets: List[Dict[bytes, List[int]]] = [dict() for _ in range(bands)]
+
+        self.exact_skips = 0
+        self.near_skips = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature, (a * x + b) mod p for every permutation and shingle at once"""
+        ## a, b and x are below 2^31 so the products fit in uint64
+        x = _shingle_hashes(text) % np.uint64(_MERSENNE_PRIME)
+        values = (self._a[:, None] * x[None, :] + self._b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        return values.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _find_near_duplicate(self, signature: np.ndarray) -> bool:
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+        candidates -= self.removed
+        if not candidates:
+            return False
+
+        candidate_signatures = np.stack([self.signatures[i] for i in candidates])
+        estimated = (candidate_signatures == signature).mean(axis=1)
+        return bool((estimated >= self.similarity).any())
+
+    def is_duplicate(self, text: str) -> bool:
+        """True if text or a near duplicate of it was added, counts the skip"""
+        if generate_unique_hash(text) in self.hashes:
+            self.exact_skips += 1
+            return True
+
+        if self.similarity < 1 and self.signatures and self._find_near_duplicate(self.signature(text)):
+            self.near_skips += 1
+            return True
+
+        return False
+
+    def add(self, text: str) -> bool:
+        """Record text, returns False if it was already recorded"""
+        text_hash = generate_unique_hash(text)
+        self.counts[text_hash] = self.counts.get(text_hash, 0) + 1
+        if text_hash in self.hashes:
+            return False
+        self.hashes.add(text_hash)
+
+        if self.similarity < 1:
+            signature = self.signature(text)
+            idx = len(self.signatures)
+            self.signatures.append(signature)
+            self.signature_ids[text_hash] = idx
+            for band, key in enumerate(self._band_keys(signature)):
+                self.buckets[band].setdefault(key, []).append(idx)
+        return True
+
+    def remove(self, text: str) -> None:
+        """
+        Undo one add of text, e.g. a reservation for a note that could not be generated.
+        The text is forgotten once every add of it was undone.
+        """
+        text_hash = generate_unique_hash(text)
+        count = self.counts.get(text_hash, 0) - 1
+        if count > 0:
+            self.counts[text_hash] = count
+            return
+        self.counts.pop(text_hash, None)
+        self.hashes.discard(text_hash)
+        idx = self.signature_ids.pop(text_hash, None)
+        if idx is not None:
+            self.removed.add(idx)
+
+    @property
+    def skipped(self) -> int:
+        return self.exact_skips + self.near_skips
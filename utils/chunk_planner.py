@@ -0,0 +1,111 @@
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.LLMHandler import estimate_tokens
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(vectors: np.ndarray, k: int, n_iter: int = 50, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means (cosine similarity) with k-means++ seeding.
+    Deterministic for a given seed, returns the cluster label of every vector.
+    """
+    n = len(vectors)
+    if k >= n:
+        return np.arange(n)
+
+    x = _normalize(np.asarray(vectors, dtype=np.float32))
+    rng = np.random.default_rng(seed)
+
+    ## k-means++ on cosine distance
+    centroids = [x[rng.integers(n)]]
+    closest = 1 - x @ centroids[0]
+    for _ in range(1, k):
+        weights = np.maximum(closest, 0) ** 2
+        total = weights.sum()
+        idx = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids.append(x[idx])
+        closest = np.minimum(closest, 1 - x @ x[idx])
+    centroids = np.stack(centroids)
+
+    labels = np.full(n, -1)
+    for _ in range(n_iter):
+        new_labels = np.argmax(x @ centroids.T, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        counts = np.bincount(labels, minlength=k)
+        ## an empty cluster keeps its old centroid
+        centroids = np.where(counts[:, None] > 0, _normalize(sums), centroids)
+
+    return labels
+
+
+def plan_chunk_groups(
+    chunks: Sequence[str],
+    chunk_embeddings,
+    chunks_per_group: int = 4,
+    seed: int = 0,
+) -> Tuple[List[List[int]], np.ndarray]:
+    """
+    Cluster the chunks of a document into topic groups of about chunks_per_group chunks.
+
+    Returns:
+        groups: chunk indices per group, in document order, groups ordered by their first chunk
+        centroids: normalized mean embedding of every group, aligned with groups
+    """
+    n = len(chunks)
+    if n == 0:
+        return [], np.empty((0, 0), dtype=np.float32)
+
+    embeddings = np.asarray(chunk_embeddings, dtype=np.float32)
+    k = max(1, math.ceil(n / max(1, chunks_per_group)))
+    labels = kmeans(embeddings, k, seed=seed)
+
+    groups = {}
+    for idx, label in enumerate(labels):
+        groups.setdefault(int(label), []).append(idx)
+    ordered = sorted(groups.values(), key=lambda members: members[0])
+
+    centroids = _normalize(np.stack([embeddings[members].mean(axis=0) for members in ordered]))
+    return ordered, centroids
+
+
+def estimate_plan_cost(
+    groups: Sequence[Sequence[int]],
+    chunks: Sequence[str],
+    system_prompt: str = "",
+    n_context: int = 5,
+    max_prompt_tokens: Optional[int] = None,
+) -> dict:
+    """
+    Up front estimate of the LLM calls and prompt tokens of a plan. Every call sends the
+    system prompt, the member chunks of its group and about n_context retrieved chunks of
+    average size, cut to max_prompt_tokens like the prompt builder does.
+    """
+    chunk_tokens = [estimate_tokens(chunk) for chunk in chunks]
+    avg_chunk_tokens = sum(chunk_tokens) / len(chunk_tokens) if chunk_tokens else 0
+    system_tokens = estimate_tokens(system_prompt)
+
+    prompt_tokens = 0
+    for members in groups:
+        context_tokens = sum(chunk_tokens[idx] for idx in members) + n_context * avg_chunk_tokens
+        if max_prompt_tokens:
+            context_tokens = min(context_tokens, max(0, max_prompt_tokens - system_tokens))
+        prompt_tokens += system_tokens + context_tokens
+
+    return {
+        "chunks": len(chunks),
+        "llm_calls": len(groups),
+        "llm_calls_without_plan": len(chunks),
+        "prompt_tokens": int(prompt_tokens),
+    }
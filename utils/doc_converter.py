@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+## kept free of ChromaDB/embedding imports so conversion worker processes stay light.
+## docling (and with it torch) is imported on first conversion, so init_conversion_worker
+## can still set the OpenMP thread count of a fresh worker.
+
+IMAGE_RESOLUTION_SCALE = 2.0
+
+
+_doc_converter = None
+_doc_converter_lock = threading.Lock()
+
+
+def get_doc_converter():
+    '''lazily build the docling converter once so the layout/table models are loaded a single time per process'''
+    global _doc_converter
+
+    with _doc_converter_lock:
+        if _doc_converter is None:
+            from docling.datamodel.base_models import InputFormat
+            from docling.datamodel.pipeline_options import PdfPipelineOptions
+            from docling.document_converter import DocumentConverter, PdfFormatOption
+
+            pipeline_options = PdfPipelineOptions()
+            pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
+            pipeline_options.generate_page_images = True
+            pipeline_options.generate_picture_images = True
+
+            start_time = time.time()
+            _doc_converter = DocumentConverter(
+                format_options={
+                    InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+                }
+            )
+            _doc_converter.initialize_pipeline(InputFormat.PDF)
+            print(f'TIME TAKEN to initialize DocumentConverter: {time.time() - start_time}')
+
+    return _doc_converter
+
+
+def convert_doc_to_markdown(source):
+    '''read PDF and convert to MD with embedded images'''
+    from docling_core.types.doc import ImageRefMode
+
+    input_doc_path = Path(source)
+    # output_dir = Path(save_root)
+
+    doc_converter = get_doc_converter()
+
+    start_time = time.time()
+
+    conv_res = doc_converter.convert(input_doc_path)
+
+    # output_dir.mkdir(parents=True, exist_ok=True)
+    # doc_filename = conv_res.input.file.stem
+
+    end_time = time.time()
+
+    md_dump = conv_res.document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
+
+    print(f'TIME TAKEN to convert doc to MD: {end_time - start_time}')
+
+    return md_dump
+
+
+def convert_all(sources):
+    '''
+    convert several documents with docling's multi document conversion, sharing one converter.
+    Yields (source, markdown) in input order, markdown is None if the conversion failed.
+    '''
+    from docling.datamodel.base_models import ConversionStatus
+    from docling_core.types.doc import ImageRefMode
+
+    sources = list(sources)
+    doc_converter = get_doc_converter()
+    input_doc_paths = [Path(source) for source in sources]
+
+    start_time = time.time()
+
+    for source, conv_res in zip(sources, doc_converter.convert_all(input_doc_paths, raises_on_error=False)):
+        if conv_res.status not in (ConversionStatus.SUCCESS, ConversionStatus.PARTIAL_SUCCESS):
+            print(f'ERROR while converting {source} to MD: {conv_res.status}')
+            yield source, None
+            continue
+
+        yield source, conv_res.document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
+
+    print(f'TIME TAKEN to convert {len(sources)} docs to MD: {time.time() - start_time}')
+
+
+def convert_batch(sources):
+    '''process pool task, converts a batch of documents with convert_all and returns the markdown of each'''
+    return [md_dump for _, md_dump in convert_all(sources)]
+
+
+def init_conversion_worker(num_threads):
+    '''process pool initializer, caps torch threads so parallel workers don't oversubscribe the CPU'''
+    ## read by OpenMP when torch loads, which happens on the worker's first conversion
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
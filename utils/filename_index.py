@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, List, Optional
+
+from utils.side_store import SQLiteStore, StoreRegistry
+
+
+class FilenameIndex(SQLiteStore):
+    """
+    Side index of the source files whose chunks are stored in a collection, with their chunk counts.
+
+    Kept up to date when chunks are added or a file is deleted, so listing the stored files
+    doesn't need a scan of the collection's metadata. A collection is marked as built once its
+    index has been filled, either by a first scan or by tracking it from the start.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            collection TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            chunk_count INTEGER NOT NULL,
+            PRIMARY KEY (collection, filename)
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS built_collections (collection TEXT PRIMARY KEY)",
+    )
+
+    def __init__(self, path: str = "filename_index.sqlite"):
+        super().__init__(path)
+
+    def is_built(self, collection: str) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM built_collections WHERE collection = ?", (collection,)
+            ).fetchone()
+        return row is not None
+
+    def filenames(self, collection: str) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT filename FROM files WHERE collection = ? AND chunk_count > 0 ORDER BY filename",
+                (collection,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, collection: str, filename_counts: Dict[str, int]) -> None:
+        """Add chunk counts for files"""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO files (collection, filename, chunk_count) VALUES (?, ?, ?) "
+                "ON CONFLICT (collection, filename) DO UPDATE SET chunk_count = chunk_count + excluded.chunk_count",
+                [(collection, filename, count) for filename, count in filename_counts.items()],
+            )
+            self.conn.commit()
+
+    def remove(self, collection: str, filenames: Iterable[str]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM files WHERE collection = ? AND filename = ?",
+                [(collection, filename) for filename in filenames],
+            )
+            self.conn.commit()
+
+    def rebuild(self, collection: str, filename_counts: Dict[str, int]) -> None:
+        """Replace the index of a collection, e.g. with the counts of a full scan"""
+        with self.lock:
+            self.conn.execute("DELETE FROM files WHERE collection = ?", (collection,))
+            self.conn.executemany(
+                "INSERT INTO files (collection, filename, chunk_count) VALUES (?, ?, ?)",
+                [(collection, filename, count) for filename, count in filename_counts.items()],
+            )
+            self.conn.execute("INSERT OR IGNORE INTO built_collections (collection) VALUES (?)", (collection,))
+            self.conn.commit()
+
+
+_filename_indexes: StoreRegistry[FilenameIndex] = StoreRegistry(
+    FilenameIndex, "FILENAME_INDEX_PATH", "filename_index.sqlite"
+)
+
+
+def get_filename_index(path: Optional[str] = None) -> FilenameIndex:
+    """
+    Return the process wide filename index. Defaults to the FILENAME_INDEX_PATH env var,
+    or filename_index.sqlite inside CHROMA_DB_PATH.
+    """
+    return _filename_indexes.get(path)
@@ -0,0 +1,117 @@
+import os
+import re
+import tempfile
+from typing import Optional
+
+from utils.basic_utils import generate_unique_hash
+from utils.side_store import StoreRegistry
+
+# Length of the content hash used as blob key and in <reference image ...> tags.
+# Kept short so the LLM can copy the tag back verbatim.
+IMAGE_HASH_LENGTH = 20
+
+
+class ImageBlobStore:
+    """
+    Content-addressed on-disk store for base64 image markdown.
+
+    Each image is written once to <root>/<hash[:2]>/<hash>.txt, identical figures
+    share a single file and only the hash needs to be kept in Chroma metadata.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _blob_path(self, image_hash: str) -> str:
+        return os.path.join(self.root, image_hash[:2], f"{image_hash}.txt")
+
+    def put(self, image_data: str) -> str:
+        """Store the image if it is not present yet and return its hash"""
+        image_hash = generate_unique_hash(image_data)[:IMAGE_HASH_LENGTH]
+        blob_path = self._blob_path(image_hash)
+
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            ## write to a temp file first so concurrent writers never expose a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(image_data)
+            os.replace(tmp_path, blob_path)
+
+        return image_hash
+
+    def get(self, image_hash: str) -> Optional[str]:
+        """Return the stored image markdown or None if the hash is unknown"""
+        try:
+            with open(self._blob_path(image_hash), "r", encoding="utf-8") as f:
+                return f.read()
+        except (FileNotFoundError, OSError):
+            return None
+
+    def contains(self, image_hash: str) -> bool:
+        return os.path.exists(self._blob_path(image_hash))
+
+
+_blob_stores: StoreRegistry[ImageBlobStore] = StoreRegistry(ImageBlobStore, "IMAGE_BLOB_STORE_PATH", "image_blobs")
+
+
+def get_image_blob_store(root: Optional[str] = None) -> ImageBlobStore:
+    """
+    Return the process wide blob store. Defaults to the IMAGE_BLOB_STORE_PATH env var,
+    or an image_blobs directory inside CHROMA_DB_PATH.
+    """
+    return _blob_stores.get(root)
+
+
+def resolve_image_reference(value) -> Optional[str]:
+    """
+    Resolve an image hash from chunk metadata to its markdown. merge_dicts turns
+    repeated keys into lists, so the first resolvable hash of a list is used.
+    """
+    if isinstance(value, list):
+        for item in value:
+            resolved = resolve_image_reference(item)
+            if resolved is not None:
+                return resolved
+        return None
+
+    if not isinstance(value, str):
+        return None
+
+    ## records written before the blob store hold the image itself
+    if value.startswith("![Image]"):
+        return value
+
+    return get_image_blob_store().get(value)
+
+
+def dissect_markdown_with_images(markdown_text, persist=True):
+    """
+    Dissects a markdown text with embedded images, replacing them with content-addressed
+    references and writing the image data once to the image blob store.
+
+    Args:
+        markdown_text (str): The markdown text containing image embeddings.
+        persist (bool): Write the images to the blob store. With False the images are only
+            stripped, for callers that never resolve the references.
+
+    Returns:
+        tuple: Updated markdown text with references and a dictionary mapping references to image hashes.
+    """
+    image_pattern = r'!\[Image\]\((.*?)\)'  # Pattern to specifically match ![Image](data...)
+    references = {}
+    blob_store = get_image_blob_store() if persist else None
+
+    def replace_with_reference(match):
+        image_data = match.group(0)  # Full matched string
+        if blob_store is not None:
+            image_hash = blob_store.put(image_data)
+        else:
+            image_hash = generate_unique_hash(image_data)[:IMAGE_HASH_LENGTH]
+        ref_key = f"<reference image {image_hash}>"
+        references[ref_key] = image_hash
+        return ref_key
+
+    updated_markdown = re.sub(image_pattern, replace_with_reference, markdown_text)
+    return updated_markdown, references
@@ -0,0 +1,185 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.LLMHandler import estimate_tokens
+
+# Prompt token budget per provider. Override with <PROVIDER>_PROMPT_TOKENS env vars.
+DEFAULT_PROMPT_BUDGETS = {
+    "gemini": 32_000,
+    "huggingface": 6_000,
+    "ollama": 3_000,
+}
+
+## share of the budget older chat turns may use, retrieved context gets the rest
+HISTORY_SHARE = 0.25
+
+_token_counters: Dict[tuple, Callable[[str], int]] = {}
+_token_counters_lock = threading.Lock()
+
+
+def _load_hf_tokenizer(model_name: str):
+    """Tokenizer of a HuggingFace model if it is already in the local cache, never downloads"""
+    try:
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+    except Exception:
+        return None
+
+
+def get_token_counter(provider: str, model_name: Optional[str] = None) -> Callable[[str], int]:
+    """
+    Return a text -> token count function for a provider/model.
+
+    HuggingFace models use their own tokenizer when it is cached locally. Other
+    providers (and missing tokenizers) fall back to estimate_tokens, counting tokens
+    for Gemini would cost an API round trip per call.
+    """
+    key = (provider, model_name)
+    with _token_counters_lock:
+        if key not in _token_counters:
+            counter = estimate_tokens
+            if provider == "huggingface" and model_name:
+                tokenizer = _load_hf_tokenizer(model_name)
+                if tokenizer is not None:
+                    counter = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+            _token_counters[key] = counter
+        return _token_counters[key]
+
+
+def get_prompt_budget(provider: str) -> int:
+    value = os.environ.get(f"{provider.upper()}_PROMPT_TOKENS")
+    if value:
+        return int(value)
+    return DEFAULT_PROMPT_BUDGETS.get(provider, 4_000)
+
+
+class PromptBuilder:
+    """
+    Assembles user prompts within a token budget.
+
+    Retrieved documents are added in rank order until the budget is used up, the
+    document that crosses the limit is truncated and the rest are dropped. Chat history
+    keeps the most recent turns that fit in its share of the budget.
+    """
+
+    def __init__(self, provider: str, model_name: Optional[str] = None, max_tokens: Optional[int] = None):
+        self.provider = provider
+        self.model_name = model_name
+        self.max_tokens = max_tokens or get_prompt_budget(provider)
+        self.count = get_token_counter(provider, model_name)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        n_tokens = self.count(text)
+        if n_tokens <= max_tokens:
+            return text
+
+        end = int(len(text) * max_tokens / n_tokens)
+        while end > 0 and self.count(text[:end]) > max_tokens:
+            end = int(end * 0.9)
+        return text[:end]
+
+    def fit_documents(self, documents: Sequence[str], max_tokens: int, separator: str = "\n") -> Tuple[List[str], int]:
+        """Returns (documents that fit in rank order, tokens used)"""
+        separator_tokens = self.count(separator) if separator else 0
+        fitted, used = [], 0
+        for document in documents:
+            remaining = max_tokens - used - (separator_tokens if fitted else 0)
+            n_tokens = self.count(document)
+            if n_tokens <= remaining:
+                fitted.append(document)
+                used += n_tokens + (separator_tokens if len(fitted) > 1 else 0)
+                continue
+
+            ## keep the start of the document that crosses the budget, drop the lower ranked rest
+            truncated = self.truncate(document, remaining)
+            if truncated:
+                fitted.append(truncated)
+                used += self.count(truncated) + (separator_tokens if len(fitted) > 1 else 0)
+            break
+        return fitted, used
+
+    def fit_history(self, history: Sequence[dict], max_tokens: int) -> Tuple[str, int, int]:
+        """
+        Returns (history text of the most recent turns that fit, turns kept, tokens used).
+
+        A turn longer than half the budget keeps only its start, so a long reply doesn't push out
+        the question before it. The turn that crosses the budget is truncated, older turns are dropped.
+        """
+        turn_limit = max_tokens // 2
+        lines, used = [], 0
+        for turn in reversed(history):
+            prefix = f"{turn.get('role', '').capitalize()}: "
+            content = turn.get("content", "")
+            line = f"{prefix}{content}\n"
+            n_tokens = self.count(line)
+
+            limit = min(turn_limit, max_tokens - used)
+            if n_tokens > limit:
+                truncated = self.truncate(content, limit - self.count(prefix) - 1)
+                if not truncated:
+                    break
+                line = f"{prefix}{truncated}\n"
+                n_tokens = self.count(line)
+
+            lines.append(line)
+            used += n_tokens
+            if used >= max_tokens:
+                break
+        lines.reverse()
+        return "".join(lines), len(lines), used
+
+    def build_notes_prompt(self, documents: Sequence[str], system_prompt: str = "") -> Tuple[str, dict]:
+        """Join retrieved chunks for note generation, returns (user_prompt, usage)"""
+        budget = self.max_tokens - self.count(system_prompt)
+        fitted, used = self.fit_documents(documents, budget)
+
+        usage = {
+            "prompt_tokens": used + self.count(system_prompt),
+            "budget": self.max_tokens,
+            "documents_used": len(fitted),
+            "documents_total": len(documents),
+        }
+        self.report(usage)
+        return "\n".join(fitted), usage
+
+    def build_chat_prompt(
+        self,
+        message: str,
+        history: Sequence[dict],
+        documents: Sequence[str],
+        system_prompt: str = "",
+    ) -> Tuple[str, dict, int]:
+        """
+        Build the chat prompt '<history>User: <message>\n\nCONTEXT:\n<documents>'.
+        The message always goes in, context and history share the rest of the budget.
+
+        Returns:
+            (user_prompt, usage, number of documents used)
+        """
+        fixed = f"User: {message}\n\nCONTEXT:\n"
+        remaining = self.max_tokens - self.count(system_prompt) - self.count(fixed)
+
+        history_text, turns_used, history_tokens = self.fit_history(history, int(remaining * HISTORY_SHARE))
+        fitted, context_tokens = self.fit_documents(documents, remaining - history_tokens)
+
+        usage = {
+            "prompt_tokens": self.max_tokens - remaining + history_tokens + context_tokens,
+            "budget": self.max_tokens,
+            "documents_used": len(fitted),
+            "documents_total": len(documents),
+            "history_turns_used": turns_used,
+            "history_turns_total": len(history),
+        }
+        self.report(usage)
+        return f"{history_text}{fixed}" + "\n".join(fitted), usage, len(fitted)
+
+    def report(self, usage: dict) -> None:
+        print(
+            f"Prompt for {self.provider}/{self.model_name}: {usage['prompt_tokens']}/{usage['budget']} tokens, "
+            + ", ".join(f"{k}={v}" for k, v in usage.items() if k not in ("prompt_tokens", "budget"))
+        )
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Generic, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def default_store_path(env_var: str, default_name: str) -> str:
+    """Path of a side store, the env_var override or default_name inside CHROMA_DB_PATH"""
+    return os.environ.get(env_var, os.path.join(os.environ.get("CHROMA_DB_PATH", "."), default_name))
+
+
+class SQLiteStore:
+    """
+    Base of the SQLite side stores kept next to the vector DB.
+
+    Opens one connection shared across threads behind self.lock, creating the parent
+    directory first, and runs the SCHEMA statements of the subclass.
+    """
+
+    SCHEMA: Sequence[str] = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+
+class StoreRegistry(Generic[T]):
+    """Process wide stores, one per path, created on first use"""
+
+    def __init__(self, factory: Callable[[str], T], env_var: str, default_name: str):
+        self.factory = factory
+        self.env_var = env_var
+        self.default_name = default_name
+        self._stores: Dict[str, T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Optional[str] = None) -> T:
+        if path is None:
+            path = default_store_path(self.env_var, self.default_name)
+
+        with self._lock:
+            if path not in self._stores:
+                self._stores[path] = self.factory(path)
+            return self._stores[path]
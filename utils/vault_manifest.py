@@ -0,0 +1,117 @@
+import os
+from typing import Dict, Optional
+
+from utils.side_store import SQLiteStore, StoreRegistry
+
+
+class VaultManifest(SQLiteStore):
+    """
+    Persisted record of the vault notes mirrored in the notes collection.
+
+    Maps the absolute path of every synced note to its (mtime, size, content hash, Chroma id)
+    so a sync only needs to stat the vault and touch the files that changed.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS notes (
+            path TEXT PRIMARY KEY,
+            vault_path TEXT NOT NULL,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            id TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_vault_path ON notes (vault_path)",
+    )
+
+    def __init__(self, path: str = "vault_manifest.sqlite"):
+        super().__init__(path)
+
+    def entries(self, vault_root: str, recursive: bool = True) -> Dict[str, dict]:
+        """Return path -> entry for the notes under vault_root (only its top level if not recursive)"""
+        vault_root = os.path.normpath(os.path.abspath(vault_root))
+        with self.lock:
+            if recursive:
+                prefix = os.path.join(vault_root, "")
+                rows = self.conn.execute(
+                    "SELECT path, vault_path, mtime, size, hash, id FROM notes "
+                    "WHERE vault_path = ? OR substr(vault_path, 1, ?) = ?",
+                    (vault_root, len(prefix), prefix),
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT path, vault_path, mtime, size, hash, id FROM notes WHERE vault_path = ?",
+                    (vault_root,),
+                ).fetchall()
+
+        return {
+            row[0]: {"vault_path": row[1], "mtime": row[2], "size": row[3], "hash": row[4], "id": row[5]}
+            for row in rows
+        }
+
+    def get(self, path: str) -> Optional[dict]:
+        path = os.path.normpath(os.path.abspath(path))
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT vault_path, mtime, size, hash, id FROM notes WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"vault_path": row[0], "mtime": row[1], "size": row[2], "hash": row[3], "id": row[4]}
+
+    def upsert(self, entries: Dict[str, dict]) -> None:
+        """Insert or replace path -> {mtime, size, hash, id} entries"""
+        rows = []
+        for path, entry in entries.items():
+            path = os.path.normpath(os.path.abspath(path))
+            rows.append((path, os.path.dirname(path), entry["mtime"], entry["size"], entry["hash"], entry["id"]))
+
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO notes (path, vault_path, mtime, size, hash, id) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def remove(self, paths) -> None:
+        rows = [(os.path.normpath(os.path.abspath(path)),) for path in paths]
+        with self.lock:
+            self.conn.executemany("DELETE FROM notes WHERE path = ?", rows)
+            self.conn.commit()
+
+
+_manifests: StoreRegistry[VaultManifest] = StoreRegistry(
+    VaultManifest, "VAULT_MANIFEST_PATH", "vault_manifest.sqlite"
+)
+
+
+def get_vault_manifest(path: Optional[str] = None) -> VaultManifest:
+    """
+    Return the process wide manifest. Defaults to the VAULT_MANIFEST_PATH env var,
+    or vault_manifest.sqlite inside CHROMA_DB_PATH.
+    """
+    return _manifests.get(path)
+
+
+def scan_vault(vault_root: str, recursive: bool = True) -> Dict[str, tuple]:
+    """
+    Return absolute path -> (directory as walked from vault_root, stat) for every .md file.
+    The walked directory matches the vault_path stored in the notes collection.
+    """
+    found = {}
+
+    if recursive:
+        for root, _, files in os.walk(vault_root):
+            for fname in files:
+                if fname.lower().endswith(".md"):
+                    full_path = os.path.join(root, fname)
+                    found[os.path.normpath(os.path.abspath(full_path))] = (root, os.stat(full_path))
+    else:
+        with os.scandir(vault_root) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(".md"):
+                    found[os.path.normpath(os.path.abspath(entry.path))] = (vault_root, entry.stat())
+
+    return found
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from utils.vault_manifest import scan_vault
+
+
+class VaultWatcher:
+    """
+    Polls a vault for created, modified, deleted and renamed notes and calls on_change
+    once the vault has been quiet for `debounce` seconds, so a burst of edits
+    (or a rename, seen as a delete plus a create) is applied as one batch.
+    """
+
+    def __init__(
+        self,
+        vault_root: str,
+        on_change: Callable[[str], object],
+        interval: float = 2.0,
+        debounce: float = 1.0,
+        recursive: bool = True,
+    ):
+        self.vault_root = vault_root
+        self.on_change = on_change
+        self.interval = interval
+        self.debounce = debounce
+        self.recursive = recursive
+
+        self._snapshot = None
+        self._dirty = False
+        self._last_change = 0.0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _take_snapshot(self):
+        return {
+            path: (stat.st_mtime, stat.st_size)
+            for path, (_, stat) in scan_vault(self.vault_root, recursive=self.recursive).items()
+        }
+
+    def poll_once(self) -> bool:
+        """Check the vault once, returns True if on_change was called"""
+        snapshot = self._take_snapshot()
+        now = time.monotonic()
+
+        if snapshot != self._snapshot:
+            ## something changed, wait for the vault to settle before syncing
+            self._snapshot = snapshot
+            self._dirty = True
+            self._last_change = now
+            return False
+
+        if self._dirty and now - self._last_change >= self.debounce:
+            self._dirty = False
+            self.on_change(self.vault_root)
+            return True
+
+        return False
+
+    def run(self) -> None:
+        """Sync once, then poll until stop() is called"""
+        self._snapshot = self._take_snapshot()
+        self.on_change(self.vault_root)
+
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"ERROR while watching {self.vault_root}: {e}")
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name=f"vault-watcher-{os.path.basename(self.vault_root)}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Keep the notes collection in sync with an Obsidian vault.")
+    parser.add_argument("vault", help="path to the vault directory")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between polls")
+    parser.add_argument("--debounce", type=float, default=1.0, help="seconds the vault must be quiet before syncing")
+    args = parser.parse_args()
+
+    from generate_notes_from_doc import sync_vdb_wit_vault_recursive
+
+    watcher = VaultWatcher(args.vault, sync_vdb_wit_vault_recursive, interval=args.interval, debounce=args.debounce)
+    print(f"Watching {args.vault}. Press Ctrl+C to stop.")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass